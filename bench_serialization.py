@@ -0,0 +1,113 @@
+"""Compare the old hand-built row dicts with serializers.RowSchema.
+
+Serializes a synthetic pending-requests result both ways and prints rows per
+second for the conversion alone and for conversion plus JSON encoding:
+
+    python bench_serialization.py            # 10,000 rows
+    python bench_serialization.py 50000 5    # rows, repeats
+"""
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+from serializers import RowSchema, dumps, orjson
+
+PENDING_REQUEST_ROW = RowSchema([
+    ("id", "str"), ("idno", "str"), ("name", "str"), ("email", "str"), ("level", "str"),
+    ("method", "str"), ("payment", "str"), ("status", "str"), ("counter", "int"),
+    ("request_id", "str"), ("schedule", "datetime")
+])
+
+
+def make_rows(count):
+    """Rows shaped like a dictionary cursor's result for /api/pending_requests"""
+    start = datetime(2025, 1, 6, 8, 0)
+    rows = []
+    for i in range(count):
+        rows.append({
+            "id": i + 1,
+            "idno": f"2025-{i:05d}",
+            "name": f"Student {i}",
+            "email": f"student{i}@example.com" if i % 7 else None,
+            "level": "college" if i % 2 else "shs",
+            "method": "cash",
+            "payment": "tuition" if i % 3 else None,
+            "status": "oncall" if i % 10 == 0 else "pending",
+            "counter": 5 if i % 10 == 0 else None,
+            "request_id": f"REQ-{i:06d}",
+            "schedule": start + timedelta(minutes=i),
+        })
+    return rows
+
+
+def legacy_convert(users_raw):
+    """The per-endpoint loop that RowSchema replaced"""
+    users_processed = []
+    for user_row in users_raw:
+        processed_user = {
+            "id": str(user_row["id"]) if user_row["id"] is not None else "",
+            "idno": str(user_row["idno"]) if user_row["idno"] is not None else "",
+            "name": str(user_row["name"]) if user_row["name"] is not None else "",
+            "email": str(user_row["email"]) if user_row["email"] is not None else "",
+            "level": str(user_row["level"]) if user_row["level"] is not None else "",
+            "method": str(user_row["method"]) if user_row["method"] is not None else "",
+            "payment": str(user_row["payment"]) if user_row["payment"] is not None else "",
+            "status": str(user_row["status"]) if user_row["status"] is not None else "",
+            "counter": int(user_row["counter"]) if user_row["counter"] is not None else None,
+            "request_id": str(user_row["request_id"]) if user_row["request_id"] is not None else "",
+            "schedule": None
+        }
+        schedule = user_row["schedule"]
+        if schedule:
+            if isinstance(schedule, datetime):
+                processed_user['schedule'] = schedule.isoformat()
+            else:
+                processed_user['schedule'] = str(schedule)
+        users_processed.append(processed_user)
+    return users_processed
+
+
+def legacy_encode(rows):
+    # What jsonify() does with JSON_SORT_KEYS on and pretty printing off
+    return json.dumps(legacy_convert(rows), sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def schema_encode(rows):
+    return dumps(PENDING_REQUEST_ROW.many(rows))
+
+
+def best_time(func, rows, repeats):
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func(rows)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv):
+    count = int(argv[0]) if argv else 10000
+    repeats = int(argv[1]) if len(argv) > 1 else 5
+    rows = make_rows(count)
+
+    if legacy_convert(rows) != PENDING_REQUEST_ROW.many(rows):
+        print("RowSchema output differs from the legacy loop")
+        return 1
+
+    print(f"{count} rows, best of {repeats}, encoder: {'orjson' if orjson else 'json'}")
+    cases = [
+        ("convert", legacy_convert, PENDING_REQUEST_ROW.many),
+        ("convert + encode", legacy_encode, schema_encode),
+    ]
+    for label, before, after in cases:
+        before_time = best_time(before, rows, repeats)
+        after_time = best_time(after, rows, repeats)
+        print(f"{label:<18} before {count / before_time:>12,.0f} rows/s   "
+              f"after {count / after_time:>12,.0f} rows/s   x{before_time / after_time:.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
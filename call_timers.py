@@ -0,0 +1,77 @@
+"""Deadline timer for on-call requests.
+
+Calling a student stores an absolute users.call_deadline instead of a counter
+that a sweep decrements every minute. The timer keeps those deadlines in a heap
+so the auto-reject job only has to run when the earliest one passes:
+
+    call_timer.arm(user_id, deadline)       # after call_student commits
+    due = call_timer.pop_due()              # in the auto-reject job
+    call_timer.next_deadline()              # when to run it next
+
+on_change is called whenever deadlines are armed or replaced, so the job can be
+woken for a deadline sooner than the one it is sleeping towards.
+
+Re-arming a request replaces its deadline; entries superseded that way are
+skipped lazily when they reach the top of the heap.
+"""
+import heapq
+import threading
+from datetime import datetime
+
+
+class DeadlineTimer:
+    """Min-heap of (deadline, key) with lazy removal of replaced deadlines"""
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self._heap = []
+        # key -> current deadline; heap entries that don't match are stale
+        self._deadlines = {}
+        self._lock = threading.Lock()
+
+    def arm(self, key, deadline):
+        with self._lock:
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, key))
+        self._notify()
+
+    def disarm(self, key):
+        with self._lock:
+            self._deadlines.pop(key, None)
+
+    def reset(self, deadlines):
+        """Replace every armed deadline with `deadlines` (key -> datetime)"""
+        with self._lock:
+            self._deadlines = dict(deadlines)
+            self._heap = [(deadline, key) for key, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        self._notify()
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def _next(self):
+        # Drop superseded entries until the top of the heap is live
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """Remove and return the keys whose deadline has passed"""
+        now = now or datetime.now()
+        due = []
+        with self._lock:
+            while self._next() is not None and self._heap[0][0] <= now:
+                _, key = heapq.heappop(self._heap)
+                del self._deadlines[key]
+                due.append(key)
+        return due
+
+    def next_deadline(self):
+        with self._lock:
+            return self._next()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._deadlines)
@@ -0,0 +1,197 @@
+"""MySQL connection pool shared by the registral server and its maintenance scripts."""
+import os
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+
+DB_CONFIG = {
+    "host": "jimboyaczon.mysql.pythonanywhere-services.com",
+    "user": "jimboyaczon",
+    "password": "fk9lratv",
+    "database": "jimboyaczon$aisat-registral-db"
+}
+
+# Time zone the MySQL session reports TIMESTAMP columns in
+DB_TIMEZONE = os.environ.get("DB_TIMEZONE", "UTC")
+
+# Pool tuning, overridable from the environment
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+# Seconds a request waits for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+# Connections idle longer than this are pinged before being handed out
+DB_POOL_PING_AFTER = float(os.environ.get("DB_POOL_PING_AFTER", 10))
+# Connections older than this are replaced (PythonAnywhere drops idle ones after 300s)
+DB_POOL_RECYCLE = float(os.environ.get("DB_POOL_RECYCLE", 280))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the borrow timeout"""
+
+
+class PooledConnection:
+    """Borrowed connection; close() hands it back to the pool instead of closing the socket"""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get('_raw')
+        if raw is None:
+            raise mysql.connector.errors.OperationalError("Connection has been returned to the pool")
+        return getattr(raw, name)
+
+    def is_connected(self):
+        # Handlers only close connections that report as connected, so a borrowed
+        # connection always says yes; the pool checks real liveness itself.
+        return self._raw is not None
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool._release(raw, self._created_at)
+
+    def discard(self):
+        """Drop the underlying connection instead of returning it to the pool"""
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool._discard(raw)
+
+
+class ConnectionPool:
+    """Fixed-size pool of MySQL connections with liveness checks and usage stats"""
+
+    def __init__(self, config, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 ping_after=DB_POOL_PING_AFTER, recycle=DB_POOL_RECYCLE):
+        self.config = dict(config)
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.recycle = recycle
+
+        # Idle connections as (connection, created_at, returned_at); used LIFO so
+        # the warmest connections are reused and the rest age out.
+        self._idle = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        self._created = 0
+        self._replaced = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._timeouts = 0
+
+    def acquire(self, timeout=None):
+        """Borrow a connection, waiting up to `timeout` seconds for one to free up"""
+        timeout = self.timeout if timeout is None else timeout
+        entry = None
+        with self._cond:
+            if not self._idle and self._in_use >= self.size:
+                started = time.monotonic()
+                deadline = started + timeout
+                self._waits += 1
+                while not self._idle and self._in_use >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        self._record_wait(time.monotonic() - started)
+                        raise PoolTimeout(f"No database connection available after {timeout}s")
+                    self._cond.wait(remaining)
+                self._record_wait(time.monotonic() - started)
+            if self._idle:
+                entry = self._idle.pop()
+            self._in_use += 1
+
+        try:
+            raw, created_at = self._checkout(entry)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw, created_at)
+
+    def _record_wait(self, waited):
+        self._wait_time += waited
+        self._max_wait_time = max(self._max_wait_time, waited)
+
+    def _checkout(self, entry):
+        """Validate an idle connection (or open a new one) outside the pool lock"""
+        if entry is None:
+            return self._connect(), time.monotonic()
+
+        raw, created_at, returned_at = entry
+        now = time.monotonic()
+        alive = now - created_at < self.recycle
+        if alive and now - returned_at > self.ping_after:
+            try:
+                raw.ping(reconnect=False)
+            except mysql.connector.Error:
+                alive = False
+
+        if alive:
+            return raw, created_at
+
+        self._close_quietly(raw)
+        with self._cond:
+            self._replaced += 1
+        return self._connect(), time.monotonic()
+
+    def _connect(self):
+        raw = mysql.connector.connect(**self.config)
+        with self._cond:
+            self._created += 1
+        return raw
+
+    def _release(self, raw, created_at):
+        try:
+            # Never leak an open transaction (and its snapshot) to the next borrower
+            if raw.in_transaction:
+                raw.rollback()
+            healthy = True
+        except Exception:
+            healthy = False
+
+        if not healthy:
+            self._discard(raw)
+            return
+
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((raw, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, raw):
+        self._close_quietly(raw)
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        with self._cond:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "created": self._created,
+                "replaced": self._replaced,
+                "waits": self._waits,
+                "wait_time_total": round(self._wait_time, 4),
+                "wait_time_max": round(self._max_wait_time, 4),
+                "timeouts": self._timeouts
+            }
+
+
+db_pool = ConnectionPool(DB_CONFIG)
@@ -0,0 +1,121 @@
+"""Run EXPLAIN on the SQL in server.py and flag full table scans.
+
+Finds every literal passed to cursor.execute(), fills the %s placeholders with
+sample values and prints the plan MySQL picks for it. Statements whose plan
+reads a whole table (type ALL) or a whole index (type index) are flagged, and
+the exit status is non-zero when anything is flagged:
+
+    python explain_queries.py
+    python explain_queries.py --min-rows 500 server.py
+"""
+import argparse
+import ast
+import os
+import re
+import sys
+
+from database import db_pool
+
+EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "INSERT", "REPLACE")
+FULL_SCAN_TYPES = ("ALL", "index")
+
+# Columns whose placeholders need a value that parses as a date
+DATE_COLUMN_HINT = re.compile(r"(date|schedule|_at|deadline)\W*(>=|<=|<|>|=)\s*$", re.I)
+
+
+def render_sql(node):
+    """Turn an execute() argument into SQL text, or None when it is built at runtime"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+            elif isinstance(value.value, ast.Name) and value.value.id == 'placeholders':
+                parts.append('%s')
+            else:
+                # Optional fragments such as extra filters are left out
+                parts.append('')
+        return ''.join(parts)
+    return None
+
+
+def find_statements(path):
+    """Yield (line number, sql or None) for every cursor.execute() call in a file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr == 'execute' and node.args):
+            yield node.lineno, render_sql(node.args[0])
+
+
+def fill_placeholders(sql):
+    """Replace %s with literals of a plausible type for the column they compare against"""
+    out = []
+    pieces = sql.split('%s')
+    for i, piece in enumerate(pieces[:-1]):
+        out.append(piece)
+        context = ''.join(out)[-60:]
+        out.append("'2024-01-01 00:00:00'" if DATE_COLUMN_HINT.search(context) else "'1'")
+    out.append(pieces[-1])
+    return ''.join(out)
+
+
+def explain(cursor, sql):
+    cursor.execute("EXPLAIN " + fill_placeholders(sql))
+    columns = [c[0] for c in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='*', help="files to scan (default: server.py)")
+    parser.add_argument('--min-rows', type=int, default=0,
+                        help="only flag scans estimated to read more rows than this")
+    parser.add_argument('--all', action='store_true', help="print plans that are not flagged too")
+    args = parser.parse_args(argv)
+
+    paths = args.paths or [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')]
+
+    conn = db_pool.acquire()
+    cursor = conn.cursor()
+    flagged = 0
+    checked = 0
+    try:
+        for path in paths:
+            for lineno, sql in sorted(find_statements(path)):
+                where = f"{os.path.basename(path)}:{lineno}"
+                if sql is None:
+                    print(f"{where}: skipped (SQL built at runtime)")
+                    continue
+                statement = ' '.join(sql.split())
+                if not statement.upper().startswith(EXPLAINABLE) or 'GET_LOCK' in statement.upper():
+                    continue
+                try:
+                    plan = explain(cursor, statement)
+                except Exception as e:
+                    print(f"{where}: could not explain: {e}")
+                    continue
+                checked += 1
+                scans = [row for row in plan
+                         if row.get('type') in FULL_SCAN_TYPES and (row.get('rows') or 0) > args.min_rows]
+                if scans:
+                    flagged += 1
+                if scans or args.all:
+                    print(f"{where}: {statement[:120]}")
+                    for row in plan:
+                        marker = "FULL SCAN" if row in scans else "ok"
+                        print(f"    {marker:<9} table={row.get('table')} type={row.get('type')} "
+                              f"key={row.get('key')} rows={row.get('rows')} extra={row.get('Extra')}")
+    finally:
+        cursor.close()
+        conn.close()
+
+    print(f"Checked {checked} statements, {flagged} with full scans")
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
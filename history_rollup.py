@@ -0,0 +1,78 @@
+"""Daily rollup of transaction_history used by the history stats endpoint.
+
+log_transaction keeps the rollup current one row at a time. To rebuild it from
+the raw history (after a manual import, say):
+
+    python history_rollup.py                     # rebuild everything
+    python history_rollup.py --since 2025-01-01  # rebuild from a day onwards
+"""
+import sys
+from datetime import datetime
+
+from database import db_pool
+
+CREATE_ROLLUP_TABLE = """
+    CREATE TABLE IF NOT EXISTS transaction_history_daily (
+        stat_date DATE NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT '',
+        payment VARCHAR(20) NOT NULL DEFAULT '',
+        processed_by INT NOT NULL DEFAULT 0,
+        admin_name VARCHAR(100) NOT NULL DEFAULT '',
+        total INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (stat_date, status, payment, processed_by, admin_name)
+    )
+"""
+
+# Key columns can't be NULL, so missing values are stored as '' / 0
+ROLLUP_KEY_COLUMNS = """
+    DATE(action_date), COALESCE(status, ''), COALESCE(payment, ''),
+    COALESCE(processed_by, 0), COALESCE(admin_name, '')
+"""
+
+# Count one freshly inserted history row; run in the same transaction as the insert
+COUNT_HISTORY_ROW = f"""
+    INSERT INTO transaction_history_daily (stat_date, status, payment, processed_by, admin_name, total)
+    SELECT {ROLLUP_KEY_COLUMNS}, 1
+    FROM transaction_history WHERE id = %s
+    ON DUPLICATE KEY UPDATE total = total + 1
+"""
+
+
+def rebuild_rollup(cursor, since=None):
+    """Recompute the rollup from transaction_history, optionally only from `since` (a date) on"""
+    if since is None:
+        cursor.execute("DELETE FROM transaction_history_daily")
+        cursor.execute(f"""
+            INSERT INTO transaction_history_daily (stat_date, status, payment, processed_by, admin_name, total)
+            SELECT {ROLLUP_KEY_COLUMNS}, COUNT(*)
+            FROM transaction_history
+            WHERE action_date IS NOT NULL
+            GROUP BY 1, 2, 3, 4, 5
+        """)
+    else:
+        cursor.execute("DELETE FROM transaction_history_daily WHERE stat_date >= %s", (since,))
+        cursor.execute(f"""
+            INSERT INTO transaction_history_daily (stat_date, status, payment, processed_by, admin_name, total)
+            SELECT {ROLLUP_KEY_COLUMNS}, COUNT(*)
+            FROM transaction_history
+            WHERE action_date >= %s
+            GROUP BY 1, 2, 3, 4, 5
+        """, (since,))
+
+
+if __name__ == '__main__':
+    since = None
+    if '--since' in sys.argv[1:]:
+        since = datetime.strptime(sys.argv[sys.argv.index('--since') + 1], '%Y-%m-%d').date()
+
+    conn = db_pool.acquire()
+    cursor = conn.cursor()
+    try:
+        rebuild_rollup(cursor, since)
+        conn.commit()
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(total), 0) FROM transaction_history_daily")
+        groups, rows = cursor.fetchone()
+        print(f"Rollup rebuilt: {groups} daily groups covering {rows} history rows")
+    finally:
+        cursor.close()
+        conn.close()
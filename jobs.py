@@ -0,0 +1,259 @@
+"""Periodic background jobs that run once across every worker and host.
+
+    jobs = JobScheduler(MySQLLease(connect, "aisat_registral_jobs"))
+    jobs.add("auto_reject", auto_reject, interval=60)
+    jobs.add("queue_reconcile", reconcile, interval=10, jitter=2, leader_only=False)
+    jobs.start()
+
+One thread per process decides which jobs are due and starts each run in its
+own thread. A job never overlaps itself: its next run is scheduled from the
+moment the previous one finished, after `interval` plus up to `jitter` seconds,
+or after the number of seconds the job function returned.
+
+Jobs are leader-only by default and then run only in the process holding the
+lease. Under a WSGI server that is a MySQL named lock (GET_LOCK) held on its
+own connection, so one worker on one host wins and another takes over when its
+connection goes away. A standalone server uses a lock file instead. Jobs that
+maintain per-process state (caches, the in-memory queue) pass leader_only=False.
+"""
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # No flock() on Windows; a standalone server there is the only process anyway
+    fcntl = None
+
+
+class MySQLLease:
+    """Leadership held through a MySQL named lock on a dedicated connection"""
+
+    def __init__(self, connect, name):
+        self.connect = connect
+        self.name = name
+        self.held = False
+        self._conn = None
+
+    def renew(self):
+        """Keep or try to take the lock; return whether this process holds it"""
+        try:
+            if self._conn is None:
+                self._conn = self.connect()
+                self._conn.autocommit = True
+            cursor = self._conn.cursor()
+            try:
+                if self.held:
+                    cursor.execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", (self.name,))
+                else:
+                    cursor.execute("SELECT GET_LOCK(%s, 0)", (self.name,))
+                self.held = cursor.fetchone()[0] == 1
+            finally:
+                cursor.close()
+        except Exception as e:
+            # MySQL frees the lock with the connection, so start over next time
+            print(f"Leader lease check failed: {e}")
+            self._close()
+        return self.held
+
+    def release(self):
+        if self._conn is not None and self.held:
+            try:
+                cursor = self._conn.cursor()
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (self.name,))
+                cursor.fetchone()
+                cursor.close()
+            except Exception:
+                pass
+        self._close()
+
+    def _close(self):
+        self.held = False
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+class FileLease:
+    """Leadership held through an exclusive flock() on a local file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.held = False
+        self._file = None
+
+    def renew(self):
+        if self.held or fcntl is None:
+            self.held = True
+            return True
+        lock_file = open(self.path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        self.held = True
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self.held = False
+
+
+class Job:
+    """A named periodic job and its run-time metrics"""
+
+    def __init__(self, name, func, interval, jitter=0, leader_only=True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.leader_only = leader_only
+        self.due = time.monotonic() + random.uniform(0, jitter)
+        self.running = False
+        self.rerun = False
+
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = None
+        self.last_started = None
+        self.last_error = None
+
+    def next_delay(self, requested):
+        if isinstance(requested, (int, float)):
+            return max(0, requested)
+        return self.interval + random.uniform(0, self.jitter)
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "jitter": self.jitter,
+            "leader_only": self.leader_only,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "avg_time": round(self.total_time / self.runs, 4) if self.runs else None,
+            "max_time": round(self.max_time, 4),
+            "last_time": None if self.last_time is None else round(self.last_time, 4),
+            "last_started": self.last_started,
+            "last_error": self.last_error,
+            "next_run_in": None if self.running else round(max(0, self.due - time.monotonic()), 2)
+        }
+
+
+class JobScheduler:
+    """Runs registered jobs on their intervals, leader-only jobs only while holding the lease"""
+
+    def __init__(self, lease=None, lease_check=10):
+        self.lease = lease
+        # Seconds between lease renewals (MySQL drops connections idle for 300s)
+        self.lease_check = lease_check
+        self.leader = lease is None
+        self._jobs = {}
+        self._wake = threading.Condition()
+        self._thread = None
+
+    def add(self, name, func, interval, jitter=0, leader_only=True):
+        with self._wake:
+            self._jobs[name] = Job(name, func, interval, jitter, leader_only)
+            self._wake.notify_all()
+
+    def start(self):
+        """Start the scheduler thread (once per process)"""
+        with self._wake:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="job-scheduler", daemon=True)
+        self._thread.start()
+        print(f"Job scheduler started with jobs: {', '.join(self._jobs)}")
+
+    def run_soon(self, name):
+        """Run a job now, or straight after its current run finishes"""
+        with self._wake:
+            job = self._jobs.get(name)
+            if job is None:
+                return
+            if job.running:
+                job.rerun = True
+                job.skipped += 1
+            else:
+                job.due = time.monotonic()
+            self._wake.notify_all()
+
+    def _renew_lease(self):
+        if self.lease is None:
+            return
+        leader = self.lease.renew()
+        if leader != self.leader:
+            print("Acquired the background job lease" if leader else "Lost the background job lease")
+        self.leader = leader
+
+    def _loop(self):
+        next_lease_check = 0
+        while True:
+            now = time.monotonic()
+            if now >= next_lease_check:
+                self._renew_lease()
+                next_lease_check = now + self.lease_check
+            with self._wake:
+                waiting = []
+                for job in self._jobs.values():
+                    if job.running or (job.leader_only and not self.leader):
+                        continue
+                    if job.due <= now:
+                        job.running = True
+                        threading.Thread(target=self._run, args=(job,), name=f"job-{job.name}",
+                                         daemon=True).start()
+                    else:
+                        waiting.append(job.due)
+                timeout = min(waiting + [next_lease_check]) - time.monotonic()
+                if timeout > 0:
+                    self._wake.wait(timeout)
+
+    def _run(self, job):
+        job.last_started = time.time()
+        started = time.monotonic()
+        requested = None
+        error = None
+        try:
+            requested = job.func()
+        except Exception as e:
+            error = str(e)
+            print(f"Job {job.name} failed: {e}")
+        elapsed = time.monotonic() - started
+
+        with self._wake:
+            job.runs += 1
+            job.total_time += elapsed
+            job.max_time = max(job.max_time, elapsed)
+            job.last_time = elapsed
+            if error is not None:
+                job.failures += 1
+                job.last_error = error
+            job.running = False
+            if job.rerun:
+                job.rerun = False
+                job.due = time.monotonic()
+            else:
+                job.due = time.monotonic() + job.next_delay(requested)
+            self._wake.notify_all()
+
+    def stats(self):
+        with self._wake:
+            return {
+                "leader": self.leader,
+                "lease": type(self.lease).__name__ if self.lease is not None else None,
+                "jobs": {name: job.stats() for name, job in self._jobs.items()}
+            }
@@ -0,0 +1,265 @@
+"""Weighted fair ordering of the pending queue across payment lanes.
+
+Each lane (express, regular, priority, plus "" for requests without a payment
+type) is a heap ordered by schedule. Picking the next request looks only at the
+lane heads:
+
+  * a head that has waited longer than `aging` is taken first, oldest first,
+    so a low-weight lane is never starved;
+  * otherwise lanes take turns by smooth weighted round-robin: every lane with
+    requests gains its weight in credit, the richest lane is served and pays
+    back the total weight.
+
+Students flagged 'priority_user' are ranked as if they had booked
+`priority_boost` earlier than they did, which moves them up within their lane
+and makes them age sooner.
+
+With L lanes a pick costs O(L log n). Each lane also keeps its ranks in a
+sorted list, so a request's place in its lane is a bisect away, and
+ahead() estimates from the lane weights how many requests of every lane will be
+called before it. Both can leave out bookings whose time hasn't come yet
+(`before`), which aren't called until then. The scheduler has no lock of its
+own; QueueEngine calls it under the engine lock.
+"""
+import bisect
+import heapq
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+DEFAULT_LANE_WEIGHTS = "priority:3,express:2,regular:1"
+
+
+def parse_weights(text):
+    """ "lane:weight,lane:weight" -> {lane: weight} """
+    weights = {}
+    for part in text.split(','):
+        lane, _, weight = part.partition(':')
+        if lane.strip():
+            weights[lane.strip()] = max(1, int(weight or 1))
+    return weights
+
+
+class LanePolicy:
+    """Lane weights plus the priority-user boost and the aging limit"""
+
+    def __init__(self, weights, priority_boost=timedelta(minutes=30), aging=timedelta(minutes=60)):
+        self.weights = dict(weights)
+        self.priority_boost = priority_boost
+        self.aging = aging
+
+    def lane(self, row):
+        return row.get('payment') or ''
+
+    def weight(self, lane):
+        # Requests without a payment type are weighted like regular ones
+        return self.weights.get(lane, self.weights.get('regular', 1))
+
+    def rank(self, row):
+        """Position within a lane: boosted schedule (NULL first), then id"""
+        schedule = row['schedule'] or datetime.min
+        if row.get('flags') == 'priority_user' and schedule > datetime.min + self.priority_boost:
+            schedule -= self.priority_boost
+        return (schedule, row['id'])
+
+    def describe(self):
+        return {
+            "weights": self.weights,
+            "priority_boost_minutes": self.priority_boost.total_seconds() / 60,
+            "aging_minutes": self.aging.total_seconds() / 60
+        }
+
+
+class LaneScheduler:
+    """Per-lane heaps of pending requests and the round-robin credit between lanes"""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self._heaps = defaultdict(list)
+        # id -> (lane, rank); heap entries that don't match are stale
+        self._keys = {}
+        # lane -> sorted [(rank, id)] of the live entries, for lane positions
+        self._sorted = defaultdict(list)
+        # id -> booked time (datetime.min for walk-ins), for leaving out later bookings
+        self._booked = {}
+        self.credit = defaultdict(int)
+        self.dispatches = 0
+
+    def put(self, row):
+        lane, rank = self.policy.lane(row), self.policy.rank(row)
+        old = self._keys.get(row['id'])
+        if old == (lane, rank):
+            return
+        if old is not None:
+            self._unsort(row['id'], old)
+        self._keys[row['id']] = (lane, rank)
+        self._booked[row['id']] = row['schedule'] or datetime.min
+        heapq.heappush(self._heaps[lane], (rank, row['id']))
+        bisect.insort(self._sorted[lane], (rank, row['id']))
+
+    def drop(self, row_id):
+        old = self._keys.pop(row_id, None)
+        self._booked.pop(row_id, None)
+        if old is not None:
+            self._unsort(row_id, old)
+
+    def _unsort(self, row_id, key):
+        lane, rank = key
+        entries = self._sorted[lane]
+        i = bisect.bisect_left(entries, (rank, row_id))
+        if i < len(entries) and entries[i] == (rank, row_id):
+            del entries[i]
+
+    def reset(self, rows):
+        self._heaps = defaultdict(list)
+        self._keys = {}
+        self._booked = {}
+        for row in rows:
+            lane, rank = self.policy.lane(row), self.policy.rank(row)
+            self._keys[row['id']] = (lane, rank)
+            self._booked[row['id']] = row['schedule'] or datetime.min
+            self._heaps[lane].append((rank, row['id']))
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+        self._sorted = defaultdict(list, {lane: sorted(heap) for lane, heap in self._heaps.items()})
+
+    def _clean(self, lane, heap, skip=()):
+        # Drop entries that were re-ranked, removed, or (in take()) already picked
+        while heap and (heap[0][1] in skip or self._keys.get(heap[0][1]) != (lane, heap[0][0])):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def _heads(self, allowed=None, skip=()):
+        heads = {}
+        for lane, heap in self._heaps.items():
+            if allowed is None or lane in allowed:
+                head = self._clean(lane, heap, skip)
+                if head is not None:
+                    heads[lane] = head[0]
+        return heads
+
+    def _pick(self, heads, credit, now):
+        """Lane to serve next given each lane's head; updates `credit`"""
+        waited_since = now - self.policy.aging
+        aged = [(rank, lane) for lane, rank in heads.items() if rank[0] <= waited_since]
+        if aged:
+            return min(aged)[1]
+        total = 0
+        for lane in heads:
+            weight = self.policy.weight(lane)
+            credit[lane] += weight
+            total += weight
+        lane = max(heads, key=lambda lane: (credit[lane], self.policy.weight(lane), lane))
+        credit[lane] -= total
+        return lane
+
+    def take(self, count=None, lanes=None, eligible=None, now=None):
+        """The first `count` ids in dispatch order (all when None)
+
+        Only lanes in `lanes` (plus "") are served when it is given, and ids for
+        which eligible(id) is false are passed over without taking a turn.
+        Entries are popped while walking the heaps and pushed back afterwards,
+        so the first few cost O(L log n) each and the full order O(n log n).
+        """
+        now = now or datetime.now()
+        allowed = None if lanes is None else set(lanes) | {''}
+        credit = defaultdict(int, self.credit)
+        popped = []
+        picked = []
+        seen = set()
+        try:
+            while count is None or len(picked) < count:
+                heads = self._heads(allowed, seen)
+                if not heads:
+                    break
+                passed = [lane for lane in heads
+                          if eligible is not None and not eligible(self._heaps[lane][0][1])]
+                if passed:
+                    # Set ineligible heads aside before picking, so their lanes
+                    # don't gain round-robin credit for them
+                    for lane in passed:
+                        entry = heapq.heappop(self._heaps[lane])
+                        popped.append((lane, entry))
+                        seen.add(entry[1])
+                    continue
+                lane = self._pick(heads, credit, now)
+                entry = heapq.heappop(self._heaps[lane])
+                popped.append((lane, entry))
+                seen.add(entry[1])
+                picked.append(entry[1])
+        finally:
+            for lane, entry in popped:
+                heapq.heappush(self._heaps[lane], entry)
+        return picked
+
+    def _count(self, lane, before=None, upto=None):
+        # Entries of `lane` ranked ahead of `upto` (all when None), leaving out
+        # those booked after `before` when it is given
+        entries = self._sorted[lane]
+        end = len(entries) if upto is None else bisect.bisect_left(entries, upto)
+        if before is None:
+            return end
+        # A rank is at most priority_boost ahead of the booking: entries ranked
+        # after `before` are all booked later, and of those ranked before it
+        # only the last priority_boost worth can be
+        end = min(end, bisect.bisect_right(entries, ((before, float('inf')),)))
+        start = bisect.bisect_left(entries, ((before - self.policy.priority_boost,),), 0, end)
+        return end - sum(1 for _, row_id in entries[start:end] if self._booked[row_id] > before)
+
+    def lane_position(self, row_id, before=None):
+        """(lane, 1-based place within the lane, lane size), or None when not pending
+
+        With `before`, only requests booked for it or earlier are counted, and
+        None is returned for a request booked later.
+        """
+        key = self._keys.get(row_id)
+        if key is None:
+            return None
+        if before is not None and self._booked[row_id] > before:
+            return None
+        lane, rank = key
+        return lane, self._count(lane, before, (rank, row_id)) + 1, self._count(lane, before)
+
+    def ahead(self, row_id, before=None):
+        """{lane: requests expected to be called before row_id}
+
+        Within its own lane that is everyone ranked earlier. Round-robin serves
+        weight(other) requests of every other lane per weight(own) of this one,
+        up to however many that lane holds (booked for `before` or earlier,
+        when given). Aging is not taken into account.
+        """
+        found = self.lane_position(row_id, before)
+        if found is None:
+            return None
+        lane, position, _ = found
+        own_weight = self.policy.weight(lane)
+        ahead = {lane: position - 1}
+        for other in self._sorted:
+            size = self._count(other, before) if other != lane else 0
+            if size:
+                share = (position - 1) * self.policy.weight(other) / own_weight
+                ahead[other] = min(size, int(round(share)))
+        return ahead
+
+    def record_dispatch(self, row, now=None):
+        """Advance the round-robin credit for a request that was just called"""
+        now = now or datetime.now()
+        heads = self._heads()
+        lane = self.policy.lane(row)
+        heads.setdefault(lane, self.policy.rank(row))
+        credit = self.credit
+        waited_since = now - self.policy.aging
+        if not any(rank[0] <= waited_since for rank in heads.values()):
+            # Same update as a round-robin pick, charged to the lane actually served
+            total = 0
+            for name in heads:
+                credit[name] += self.policy.weight(name)
+                total += self.policy.weight(name)
+            credit[lane] -= total
+        for name in list(credit):
+            if name not in heads:
+                # An empty lane doesn't bank credit for later
+                del credit[name]
+        self.dispatches += 1
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,135 @@
+"""Short-lived, single-flight cache for responses every TV screen asks for.
+
+    tv_cache = MicroCache(ttl=2)
+    body = tv_cache.get("tv_pending_requests", load_pending_requests)
+
+While an entry is fresh every caller gets the stored value. When it expires,
+the first caller runs the loader and any caller arriving in the meantime waits
+for that result instead of starting its own query, so the database sees at
+most one load per key per TTL however many screens are polling.
+
+Writers call invalidate() so the next read reloads at once. The cache lives in
+one process: with several workers each keeps its own copy and the TTL bounds
+how stale another worker's copy can be.
+"""
+import threading
+import time
+
+
+class _Flight:
+    """A load in progress that other callers can wait on"""
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class MicroCache:
+    """Key -> value cache with a TTL and request coalescing on misses"""
+
+    def __init__(self, ttl, wait_timeout=15, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # How long followers wait on a stuck leader before loading themselves
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        # Signalled on every invalidate() so long-lived readers can react to writes
+        self._invalidated = threading.Condition(self._lock)
+        self.invalidations = 0
+        self._entries = {}
+        self._flights = {}
+        # Bumped by invalidate() so a load that started before a write isn't stored
+        self._generations = {}
+
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+
+    def get(self, key, loader):
+        """Return the cached value for `key`, calling loader() at most once per miss"""
+        if self.ttl <= 0:
+            return loader()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._hits += 1
+                return entry[1]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight(self._generations.get(key, 0))
+                self._flights[key] = flight
+                self._misses += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(self.wait_timeout):
+                return loader()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = loader()
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+            raise
+
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if self._generations.get(key, 0) == flight.generation:
+                if len(self._entries) >= self.max_entries:
+                    self._prune()
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+        flight.value = value
+        flight.done.set()
+        return value
+
+    def _prune(self):
+        # Keys can come from query strings, so never let expired ones pile up
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+            del self._entries[key]
+            if key not in self._flights:
+                self._generations.pop(key, None)
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+
+    def invalidate(self, *names):
+        """Drop entries whose key is one of `names` or starts with "<name>:" """
+        with self._lock:
+            for key in set(self._entries) | set(self._flights):
+                if any(key == name or key.startswith(name + ':') for name in names):
+                    self._entries.pop(key, None)
+                    # New callers start a fresh load rather than joining a stale one
+                    self._flights.pop(key, None)
+                    self._generations[key] = self._generations.get(key, 0) + 1
+            self.invalidations += 1
+            self._invalidated.notify_all()
+
+    def wait_for_invalidation(self, seen, timeout):
+        """Block until invalidations moves past `seen` or `timeout` passes; return its value"""
+        with self._invalidated:
+            if self.invalidations == seen:
+                self._invalidated.wait(timeout)
+            return self.invalidations
+
+    def stats(self):
+        """Snapshot of cache counters"""
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced
+            }
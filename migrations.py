@@ -0,0 +1,298 @@
+"""Versioned schema migrations for the registral database.
+
+Pending migrations run once when server.py starts. They can also be applied by hand:
+
+    python migrations.py           # apply pending migrations
+    python migrations.py --status  # list applied and pending versions
+"""
+import sys
+from datetime import datetime
+
+from database import db_pool
+from history_rollup import CREATE_ROLLUP_TABLE, rebuild_rollup
+from tickets import CREATE_TICKET_SEQUENCES
+from slots import CREATE_SLOT_TABLES, rebuild_counts
+
+# Named lock so several workers starting at once don't migrate concurrently
+MIGRATION_LOCK = "aisat_registral_migrations"
+
+
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def add_column(cursor, table, column, definition):
+    """Add a column unless an older deployment already created it"""
+    if not column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        print(f"Added {column} column to {table} table")
+
+
+def get_indexes(cursor, table):
+    """Map index name -> ordered column list for a table"""
+    cursor.execute("""
+        SELECT INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (table,))
+    indexes = {}
+    for index_name, column_name in cursor.fetchall():
+        indexes.setdefault(index_name, []).append(column_name)
+    return indexes
+
+
+def add_index(cursor, table, name, columns):
+    """Create an index unless it, or one with the same leading columns, already exists"""
+    indexes = get_indexes(cursor, table)
+    if name in indexes:
+        return
+    for existing_name, existing_columns in indexes.items():
+        if existing_columns[:len(columns)] == list(columns):
+            print(f"Skipping {name} on {table}: already covered by {existing_name}")
+            return
+    cursor.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+    print(f"Created index {name} on {table} ({', '.join(columns)})")
+
+
+# Indexes managed by migration 2, kept here so tools can compare them with the live schema
+QUEUE_AND_HISTORY_INDEXES = [
+    # Queue listings: status IN ('pending', 'oncall') ORDER BY schedule
+    ("users", "idx_users_status_schedule", ("status", "schedule")),
+    # Auto-reject sweep reads only status/counter (id comes with every InnoDB index)
+    ("users", "idx_users_status_counter", ("status", "counter")),
+    ("users", "idx_users_idno", ("idno",)),
+    ("users", "idx_users_email", ("email",)),
+    ("users", "idx_users_flags", ("flags",)),
+    # Date-bounded history listings and the per-status/payment stats scans
+    ("transaction_history", "idx_history_date_status", ("action_date", "status", "payment", "processed_by")),
+    ("transaction_history", "idx_history_status_date", ("status", "action_date")),
+    ("transaction_history", "idx_history_payment_date", ("payment", "action_date")),
+    ("transaction_history", "idx_history_admin_date", ("processed_by", "action_date")),
+    ("transaction_history", "idx_history_idno_date", ("idno", "action_date")),
+]
+
+
+def migration_001_baseline(cursor):
+    """Tables and columns that request handlers used to create on demand"""
+    add_column(cursor, "admins", "status", "ENUM('online', 'offline') DEFAULT 'offline'")
+    add_column(cursor, "admins", "last_active", "TIMESTAMP NULL DEFAULT NULL")
+    add_column(cursor, "admins", "is_active", "ENUM('yes', 'no') DEFAULT 'no'")
+    add_column(cursor, "admins", "room_name", "VARCHAR(255)")
+
+    add_column(cursor, "users", "flags", "VARCHAR(50) DEFAULT NULL")
+    add_column(cursor, "users", "new_user", "ENUM('yes', 'no') DEFAULT 'yes'")
+    add_column(cursor, "users", "assigned_to", "INT DEFAULT NULL")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS admin_settings (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            admin_id INT NOT NULL,
+            settings TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            UNIQUE KEY unique_admin (admin_id)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS transaction_history (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            request_id VARCHAR(20),
+            idno VARCHAR(20),
+            name VARCHAR(100),
+            level VARCHAR(20),
+            method VARCHAR(20),
+            payment VARCHAR(20),
+            status VARCHAR(20),
+            processed_by INT,
+            admin_name VARCHAR(100),
+            action_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            notes TEXT
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ticker_messages (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            message TEXT NOT NULL,
+            display_order INT DEFAULT 0,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def migration_002_queue_history_indexes(cursor):
+    """Indexes for the queue and transaction history hot paths"""
+    for table, name, columns in QUEUE_AND_HISTORY_INDEXES:
+        add_index(cursor, table, name, columns)
+
+
+def migration_003_history_keyset_index(cursor):
+    """(action_date, id) index backing keyset pagination of the history listing"""
+    add_index(cursor, "transaction_history", "idx_history_keyset", ("action_date", "id"))
+
+
+def migration_004_history_daily_rollup(cursor):
+    """Daily counts table behind the history stats, backfilled from existing history"""
+    cursor.execute(CREATE_ROLLUP_TABLE)
+    rebuild_rollup(cursor)
+
+
+def migration_005_call_deadline(cursor):
+    """Absolute on-call deadline replacing the per-minute counter countdown"""
+    add_column(cursor, "users", "call_deadline", "DATETIME NULL DEFAULT NULL")
+    add_index(cursor, "users", "idx_users_status_deadline", ("status", "call_deadline"))
+    # Requests on call during the upgrade keep the minutes they had left. Deadlines
+    # are server-local times, the same clock the server compares them with
+    cursor.execute("""
+        UPDATE users SET call_deadline = %s + INTERVAL counter MINUTE
+        WHERE status = 'oncall' AND counter IS NOT NULL AND call_deadline IS NULL
+    """, (datetime.now().replace(microsecond=0),))
+
+
+def migration_006_requests_table(cursor):
+    """requests table for appointment state, filled from the request columns of users"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS requests (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            request_id VARCHAR(20),
+            level VARCHAR(20),
+            method VARCHAR(20),
+            payment VARCHAR(20),
+            schedule DATETIME NULL DEFAULT NULL,
+            status VARCHAR(20) NULL DEFAULT NULL,
+            counter INT NULL DEFAULT NULL,
+            call_deadline DATETIME NULL DEFAULT NULL,
+            assigned_to INT NULL DEFAULT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_requests_status_schedule (status, schedule),
+            KEY idx_requests_status_deadline (status, call_deadline),
+            KEY idx_requests_user (user_id, id)
+        )
+    """)
+    # Every student with request state becomes one request. The users columns are
+    # no longer read or written, and are left in place for a rollback
+    cursor.execute("SELECT COUNT(*) FROM requests")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("""
+            INSERT INTO requests (user_id, request_id, level, method, payment, schedule,
+                                  status, counter, call_deadline, assigned_to)
+            SELECT id, request_id, level, method, payment, schedule,
+                   status, counter, call_deadline, assigned_to
+            FROM users
+            WHERE status IS NOT NULL OR request_id IS NOT NULL
+            ORDER BY id
+        """)
+        print(f"Moved {cursor.rowcount} requests out of the users table")
+
+
+def migration_007_ticket_sequences(cursor):
+    """Per-day, per-lane counters behind generated ticket numbers"""
+    cursor.execute(CREATE_TICKET_SEQUENCES)
+
+
+def migration_008_slot_capacity(cursor):
+    """Slot capacity template and booked counts, counted from existing requests"""
+    for statement in CREATE_SLOT_TABLES:
+        cursor.execute(statement)
+    rebuild_counts(cursor)
+
+
+def migration_009_open_slot_counts(cursor):
+    """Recount slot places held by open requests only, releasing those of closed ones"""
+    rebuild_counts(cursor)
+
+
+# (version, description, function) in the order they must be applied
+MIGRATIONS = [
+    (1, "Baseline tables and columns formerly created by handlers", migration_001_baseline),
+    (2, "Indexes for queue and transaction history queries", migration_002_queue_history_indexes),
+    (3, "Keyset pagination index for transaction history", migration_003_history_keyset_index),
+    (4, "Daily rollup of transaction history", migration_004_history_daily_rollup),
+    (5, "On-call deadline column", migration_005_call_deadline),
+    (6, "Requests table split out of users", migration_006_requests_table),
+    (7, "Ticket number sequences", migration_007_ticket_sequences),
+    (8, "Appointment slot capacity", migration_008_slot_capacity),
+    (9, "Slot counts from open requests only", migration_009_open_slot_counts),
+]
+
+
+def _ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def get_applied_versions(cursor):
+    _ensure_migrations_table(cursor)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def run_migrations(conn=None, lock_timeout=60):
+    """Apply every pending migration and return the versions that were applied"""
+    own_conn = conn is None
+    if own_conn:
+        conn = db_pool.acquire()
+    cursor = conn.cursor()
+    applied = []
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, lock_timeout))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError("Timed out waiting for the schema migration lock")
+        try:
+            done = get_applied_versions(cursor)
+            for version, description, migrate in MIGRATIONS:
+                if version in done:
+                    continue
+                print(f"Applying migration {version}: {description}")
+                migrate(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                conn.commit()
+                applied.append(version)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+            cursor.fetchone()
+    finally:
+        cursor.close()
+        if own_conn:
+            conn.close()
+    return applied
+
+
+def print_status():
+    conn = db_pool.acquire()
+    cursor = conn.cursor()
+    try:
+        done = get_applied_versions(cursor)
+        for version, description, _ in MIGRATIONS:
+            state = "applied" if version in done else "pending"
+            print(f"{version:>4}  {state:<8} {description}")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    if '--status' in sys.argv[1:]:
+        print_status()
+    else:
+        applied = run_migrations()
+        if applied:
+            print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+        else:
+            print("Schema is up to date")
@@ -0,0 +1,98 @@
+"""Versioned log of changes to the live queue (pending and on-call requests).
+
+Every time the queue is read from the database the new rows are diffed against
+the previous snapshot and each difference is appended to a bounded ring as a
+change record with its own version number:
+
+    {"version": 42, "op": "inserted", "id": "17", "request": {...}}
+    {"version": 43, "op": "status", "id": "17", "status": "oncall", "old_status": "pending"}
+    {"version": 44, "op": "counter", "id": "17", "counter": 4}
+    {"version": 45, "op": "updated", "id": "17", "request": {...}}
+    {"version": 46, "op": "removed", "id": "17"}
+
+Versions handed to clients are "<epoch>.<number>", where the epoch is random
+per process. A client presenting a version from another process (a restart
+or a different worker) or one older than the ring gets a full snapshot instead.
+"""
+import threading
+import uuid
+from collections import deque
+
+# Fields whose change gets its own record type; anything else is "updated"
+STATUS_FIELD = "status"
+COUNTER_FIELD = "counter"
+
+
+class QueueChangeLog:
+    """Snapshot of the queue plus a ring of the changes that led to it"""
+
+    def __init__(self, capacity=1000):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._ring = deque(maxlen=capacity)
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def current_version(self):
+        return f"{self.epoch}.{self.version}"
+
+    def observe(self, rows):
+        """Record the differences between `rows` (serialized queue rows) and the last snapshot"""
+        with self._lock:
+            current = {row["id"]: row for row in rows}
+            if self._snapshot is None:
+                # First read after start-up is the baseline, not a burst of inserts
+                self._snapshot = current
+                return 0
+
+            changes = []
+            for request_id, row in current.items():
+                old = self._snapshot.get(request_id)
+                if old is None:
+                    changes.append({"op": "inserted", "id": request_id, "request": row})
+                    continue
+                if old == row:
+                    continue
+                if old.get(STATUS_FIELD) != row.get(STATUS_FIELD):
+                    changes.append({"op": "status", "id": request_id,
+                                    "status": row.get(STATUS_FIELD), "old_status": old.get(STATUS_FIELD)})
+                if old.get(COUNTER_FIELD) != row.get(COUNTER_FIELD):
+                    changes.append({"op": "counter", "id": request_id, "counter": row.get(COUNTER_FIELD)})
+                other = set(row) | set(old)
+                other.discard(STATUS_FIELD)
+                other.discard(COUNTER_FIELD)
+                if any(old.get(field) != row.get(field) for field in other):
+                    changes.append({"op": "updated", "id": request_id, "request": row})
+            for request_id in self._snapshot:
+                if request_id not in current:
+                    changes.append({"op": "removed", "id": request_id})
+
+            for change in changes:
+                self.version += 1
+                change["version"] = self.version
+                self._ring.append(change)
+            self._snapshot = current
+            return len(changes)
+
+    def read(self, since=None):
+        """Changes after version `since`, or the whole queue when they can't be replayed"""
+        with self._lock:
+            version = self.current_version()
+            changes = self._changes_after(since)
+            if changes is None:
+                requests = list(self._snapshot.values()) if self._snapshot else []
+                return {"version": version, "snapshot": True, "requests": requests}
+            return {"version": version, "snapshot": False, "changes": changes}
+
+    def _changes_after(self, since):
+        epoch, _, number = (since or '').partition('.')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        number = int(number)
+        if number > self.version:
+            return None
+        oldest = self._ring[0]["version"] if self._ring else self.version + 1
+        if number < oldest - 1:
+            # The ring no longer holds everything after `since`
+            return None
+        return [change for change in self._ring if change["version"] > number]
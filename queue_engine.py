@@ -0,0 +1,373 @@
+"""In-process copy of the live queue: every request that is pending or on call.
+
+The engine is loaded from MySQL at start-up and kept current by the handlers
+that change the queue. They run their UPDATE, commit, and then apply the same
+change here, so queue reads are answered from memory:
+
+    conn.commit()
+    queue_engine.apply(cursor, user_ids, status=new_status)
+
+A queue row is a request joined to the student it belongs to, keyed by the
+student's user id (a student has at most one request in the queue at a time).
+Rows are kept exactly as the database returns them (datetimes, ints), indexed
+by status, payment lane and assigned admin, plus a list sorted by schedule.
+Pending rows are also fed to an optional lane_scheduler.LaneScheduler, which
+decides the order students are called in.
+
+Writes made elsewhere (another worker, a manual edit in MySQL) are picked up by
+reconcile(), which reloads the queue and reports how far memory had drifted.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+ACTIVE_STATUSES = ('pending', 'oncall')
+
+QUEUE_COLUMNS = ('id', 'idno', 'name', 'email', 'level', 'method', 'payment',
+                 'schedule', 'status', 'counter', 'call_deadline', 'request_id', 'assigned_to', 'flags')
+
+# Where each queue column comes from: the student (u) or their request (r)
+STUDENT_COLUMNS = ('id', 'idno', 'name', 'email', 'flags')
+QUEUE_SELECT_LIST = ', '.join(f"{'u' if column in STUDENT_COLUMNS else 'r'}.{column}"
+                              for column in QUEUE_COLUMNS)
+
+SELECT_QUEUE = f"SELECT {QUEUE_SELECT_LIST} FROM requests r JOIN users u ON u.id = r.user_id"
+
+SELECT_ACTIVE_QUEUE = f"{SELECT_QUEUE} WHERE r.status IN ('pending', 'oncall')"
+
+# Columns apply() can set from handler input, and how to coerce that input
+# to the type the database would hand back
+FIELD_PARSERS = {
+    'status': lambda value: value,
+    'counter': lambda value: None if value is None else int(value),
+    'schedule': lambda value: (value if value is None or isinstance(value, datetime)
+                               else datetime.strptime(str(value), '%Y-%m-%d %H:%M:%S')),
+    'call_deadline': lambda value: (value if value is None or isinstance(value, datetime)
+                                    else datetime.strptime(str(value), '%Y-%m-%d %H:%M:%S')),
+    'assigned_to': lambda value: None if value is None else int(value),
+    'name': lambda value: value,
+    'email': lambda value: value,
+    'level': lambda value: value,
+    'method': lambda value: value,
+    'payment': lambda value: value,
+    'request_id': lambda value: value,
+}
+
+
+def due_by(row, moment):
+    """True when the row can be called at `moment`: a walk-in, or booked for then or earlier
+
+    Later bookings are scheduled rather than pending: the student isn't
+    expected yet, and calling them early would time them out as a no-show.
+    """
+    return row['schedule'] is None or row['schedule'] <= moment
+
+
+def schedule_key(row):
+    """Sort key matching ORDER BY schedule ASC (NULL first), ties broken by id"""
+    schedule = row['schedule']
+    if schedule is None:
+        return (0, datetime.min, row['id'])
+    return (1, schedule, row['id'])
+
+
+class QueueEngine:
+    """Indexed in-memory queue with write-through updates from request handlers"""
+
+    def __init__(self, pool, lanes=None):
+        self.pool = pool
+        self.lanes = lanes
+        self._lock = threading.RLock()
+        self._rows = {}
+        self._by_status = defaultdict(set)
+        self._by_payment = defaultdict(set)
+        self._by_admin = defaultdict(set)
+        self._by_idno = {}
+        # (schedule_key, id) kept sorted for ordered and range reads
+        self._schedule = []
+        self.loaded = False
+        # (version, dispatches, minute) -> positions, see positions()
+        self._positions = None
+
+        self.version = 0
+        self.reconciles = 0
+        self.drift_total = 0
+        self.last_drift = 0
+        self.last_reconcile = None
+
+    # --- loading -------------------------------------------------------------
+
+    def _fetch_active(self, cursor=None):
+        own = cursor is None
+        if own:
+            conn = self.pool.acquire()
+            cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(SELECT_ACTIVE_QUEUE)
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            if own:
+                cursor.close()
+                conn.close()
+
+    def load(self, cursor=None):
+        """Replace the in-memory queue with what is in the database"""
+        rows = self._fetch_active(cursor)
+        with self._lock:
+            self._reset(rows)
+            self.loaded = True
+            self.version += 1
+        return len(rows)
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def _reset(self, rows):
+        self._rows = {}
+        self._by_status = defaultdict(set)
+        self._by_payment = defaultdict(set)
+        self._by_admin = defaultdict(set)
+        self._by_idno = {}
+        self._schedule = []
+        for row in rows:
+            self._rows[row['id']] = row
+            self._index(row)
+        self._schedule.sort()
+        if self.lanes is not None:
+            self.lanes.reset([row for row in rows if row['status'] == 'pending'])
+
+    # --- indexes -------------------------------------------------------------
+
+    def _index(self, row, keep_sorted=False):
+        row_id = row['id']
+        self._by_status[row['status']].add(row_id)
+        self._by_payment[row['payment']].add(row_id)
+        self._by_admin[row['assigned_to']].add(row_id)
+        if row['idno'] is not None:
+            self._by_idno[row['idno']] = row_id
+        entry = (schedule_key(row), row_id)
+        if keep_sorted:
+            bisect.insort(self._schedule, entry)
+        else:
+            self._schedule.append(entry)
+
+    def _unindex(self, row):
+        row_id = row['id']
+        self._by_status[row['status']].discard(row_id)
+        self._by_payment[row['payment']].discard(row_id)
+        self._by_admin[row['assigned_to']].discard(row_id)
+        if self._by_idno.get(row['idno']) == row_id:
+            del self._by_idno[row['idno']]
+        entry = (schedule_key(row), row_id)
+        i = bisect.bisect_left(self._schedule, entry)
+        if i < len(self._schedule) and self._schedule[i] == entry:
+            del self._schedule[i]
+
+    def _put(self, row):
+        old = self._rows.pop(row['id'], None)
+        if old is not None:
+            self._unindex(old)
+        if row['status'] in ACTIVE_STATUSES:
+            self._rows[row['id']] = row
+            self._index(row, keep_sorted=True)
+        if self.lanes is not None:
+            if row['status'] == 'pending':
+                self.lanes.put(row)
+            else:
+                self.lanes.drop(row['id'])
+
+    def _drop(self, row_id):
+        old = self._rows.pop(row_id, None)
+        if old is not None:
+            self._unindex(old)
+        if self.lanes is not None:
+            self.lanes.drop(row_id)
+
+    # --- writes --------------------------------------------------------------
+
+    def apply(self, cursor, ids, **fields):
+        """Mirror a committed UPDATE of `fields` on users `ids`"""
+        # Rows already queued are updated (or dropped when their status leaves
+        # the queue); rows entering it, or values that can't be coerced here,
+        # are read back by primary key instead
+        ids = [int(row_id) for row_id in ids]
+        try:
+            values = {name: FIELD_PARSERS[name](value) for name, value in fields.items()}
+        except (TypeError, ValueError):
+            return self.refresh(cursor, ids)
+
+        missing = []
+        with self._lock:
+            for row_id in ids:
+                row = self._rows.get(row_id)
+                if row is None:
+                    if values.get('status') in ACTIVE_STATUSES:
+                        missing.append(row_id)
+                    continue
+                updated = dict(row)
+                updated.update(values)
+                self._put(updated)
+            self.version += 1
+        if missing:
+            self.refresh(cursor, missing)
+
+    def refresh(self, cursor, ids):
+        """Re-read the queued requests of users `ids` and update the queue from them"""
+        ids = [int(row_id) for row_id in ids]
+        if not ids:
+            return
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(f"{SELECT_QUEUE} WHERE r.user_id IN ({placeholders}) AND r.status IN ('pending', 'oncall')",
+                       tuple(ids))
+        rows = cursor.fetchall()
+        if rows and not isinstance(rows[0], dict):
+            rows = [dict(zip(QUEUE_COLUMNS, row)) for row in rows]
+        found = {row['id']: dict(row) for row in rows}
+        with self._lock:
+            for row_id in ids:
+                if row_id in found:
+                    self._put(found[row_id])
+                else:
+                    self._drop(row_id)
+            self.version += 1
+
+    # --- reads ---------------------------------------------------------------
+
+    def _ordered(self, ids=None):
+        rows = self._rows
+        if ids is None:
+            return [rows[row_id] for _, row_id in self._schedule]
+        return [rows[row_id] for row_id in sorted(ids, key=lambda row_id: schedule_key(rows[row_id]))]
+
+    def active(self, status=None, payment=None, assigned_to=None):
+        """Queue rows in schedule order, optionally narrowed by status, lane or admin"""
+        with self._lock:
+            selected = None
+            for index, value in ((self._by_status, status), (self._by_payment, payment),
+                                 (self._by_admin, assigned_to)):
+                if value is None:
+                    continue
+                ids = index.get(value, set())
+                selected = set(ids) if selected is None else selected & ids
+            return self._ordered(selected)
+
+    def scheduled_after(self, moment, status='pending'):
+        """Rows with schedule > moment (pending by default), earliest first"""
+        with self._lock:
+            start = bisect.bisect_right(self._schedule, ((1, moment, float('inf')),))
+            return [self._rows[row_id] for _, row_id in self._schedule[start:]
+                    if self._rows[row_id]['status'] == status]
+
+    def dispatch_candidates(self, count, lanes=None, eligible=None):
+        """The next `count` pending rows in dispatch order, from `lanes` and passing eligible(row)"""
+        with self._lock:
+            if self.lanes is None:
+                rows = [row for row in self.active(status='pending')
+                        if (lanes is None or (row['payment'] or '') in lanes or not row['payment'])
+                        and (eligible is None or eligible(row))]
+                return rows[:count]
+            check = None if eligible is None else (lambda row_id: eligible(self._rows[row_id]))
+            return [self._rows[row_id] for row_id in self.lanes.take(count, lanes, check)]
+
+    def record_dispatch(self, row):
+        """Tell the lane scheduler a request was called, before the call is applied"""
+        with self._lock:
+            if self.lanes is not None:
+                self.lanes.record_dispatch(row)
+
+    def order_key(self, now=None):
+        """Changes whenever the queue, the dispatch order or the minute does
+
+        Aging moves requests up and on-call countdowns go down as time passes,
+        so anything derived from the queue is recomputed at least every minute.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            dispatches = self.lanes.dispatches if self.lanes is not None else 0
+            return (self.version, dispatches, now.replace(second=0, microsecond=0))
+
+    def positions(self, now=None):
+        """id -> 1-based place in the dispatch order for every pending row that can be called now"""
+        now = now or datetime.now()
+        with self._lock:
+            if self.lanes is None:
+                due = [row for row in self.active(status='pending') if due_by(row, now)]
+                return {row['id']: i for i, row in enumerate(due, 1)}
+            # The key changes with the minute, so bookings join the order as their time comes
+            key = self.order_key(now)
+            if self._positions is None or self._positions[0] != key:
+                order = self.lanes.take(now=now, eligible=lambda row_id: due_by(self._rows[row_id], now))
+                self._positions = (key, {row_id: i for i, row_id in enumerate(order, 1)})
+            return self._positions[1]
+
+    def lane_position(self, row_id, now=None):
+        """Place of a pending row within its lane and the requests ahead of it, or None
+
+        Only requests that can be called now are counted, and a row booked for
+        a later time has no place yet.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            if self.lanes is None:
+                return None
+            found = self.lanes.lane_position(row_id, now)
+            if found is None:
+                return None
+            lane, position, size = found
+            return {"lane": lane, "position": position, "size": size,
+                    "ahead": self.lanes.ahead(row_id, now)}
+
+    def call_deadlines(self):
+        """id -> call_deadline for every on-call row that has one"""
+        with self._lock:
+            return {row_id: self._rows[row_id]['call_deadline'] for row_id in self._by_status['oncall']
+                    if self._rows[row_id]['call_deadline'] is not None}
+
+    def get(self, row_id):
+        with self._lock:
+            return self._rows.get(int(row_id))
+
+    def find_own(self, user_id, idno=None):
+        """The caller's own queue row, matched by user id or ID number"""
+        with self._lock:
+            if str(user_id).isdigit() and int(user_id) in self._rows:
+                return self._rows[int(user_id)]
+            if idno is not None and idno in self._by_idno:
+                return self._rows[self._by_idno[idno]]
+            return None
+
+    # --- drift ---------------------------------------------------------------
+
+    def reconcile(self, cursor=None):
+        """Reload from the database and return how many rows had drifted"""
+        rows = self._fetch_active(cursor)
+        fresh = {row['id']: row for row in rows}
+        with self._lock:
+            drift = sum(1 for row_id in set(fresh) | set(self._rows)
+                        if fresh.get(row_id) != self._rows.get(row_id))
+            if drift:
+                self._reset(rows)
+                self.version += 1
+            self.loaded = True
+            self.reconciles += 1
+            self.drift_total += drift
+            self.last_drift = drift
+            self.last_reconcile = time.time()
+        return drift
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "rows": len(self._rows),
+                "by_status": {status: len(ids) for status, ids in self._by_status.items() if ids},
+                "by_payment": {str(payment): len(ids) for payment, ids in self._by_payment.items() if ids},
+                "version": self.version,
+                "reconciles": self.reconciles,
+                "drift_total": self.drift_total,
+                "last_drift": self.last_drift,
+                "last_reconcile": self.last_reconcile
+            }
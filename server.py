@@ -1,8 +1,28 @@
-from flask import Flask, request, jsonify, g, send_from_directory
+from flask import Flask, request, jsonify, g, send_from_directory, has_request_context, Response, stream_with_context
 from flask_cors import CORS
 import mysql.connector
-from datetime import datetime, timedelta
+from database import db_pool, PoolTimeout, DB_TIMEZONE
+from migrations import run_migrations
+from history_rollup import COUNT_HISTORY_ROW
+from serializers import RowSchema, json_response, dumps
+from microcache import MicroCache
+from queue_changes import QueueChangeLog
+from queue_engine import QueueEngine, QUEUE_SELECT_LIST, due_by
+from call_timers import DeadlineTimer
+from lane_scheduler import LanePolicy, LaneScheduler, parse_weights, DEFAULT_LANE_WEIGHTS
+from jobs import JobScheduler, MySQLLease, FileLease
+from service_times import ServiceTimeStats
+from tickets import TicketAllocator
+from slots import parse_schedule, slot_of, as_time, reserve_slot, release_slot, availability, SLOT_MINUTES
+from datetime import datetime, timedelta, timezone
 import os
+import re
+import base64
+import hashlib
+import csv
+import io
+import tempfile
+import math
 import jwt
 from functools import wraps
 import uuid
@@ -14,6 +34,10 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import json
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    ZoneInfo = None
 
 # Import email configuration
 
@@ -36,11 +60,79 @@ app = Flask(__name__)
 CORS(app, 
      supports_credentials=True, 
      resources={r"/api/*": {"origins": "*"}},
-     allow_headers=["Content-Type", "Authorization"],
+     allow_headers=["Content-Type", "Authorization", "If-None-Match", "Last-Event-ID"],
+     expose_headers=["X-Next-Cursor", "ETag"],
      methods=["GET", "POST", "OPTIONS"])
 
 SECRET_KEY = os.environ.get('SECRET_KEY', 'aisat_registral_secret_key')
 
+# Time zone the admin's history date filters are in when the client doesn't send ?tz=
+# (empty means dates are taken as-is in the database session time zone)
+HISTORY_TIMEZONE = os.environ.get('HISTORY_TIMEZONE', '')
+
+# Seconds the unauthenticated TV endpoints share one cached response (0 disables)
+TV_CACHE_TTL = float(os.environ.get('TV_CACHE_TTL', 2))
+tv_cache = MicroCache(TV_CACHE_TTL)
+
+# /api/tv/stream: seconds between checks for changes made by other workers,
+# seconds of silence before a heartbeat, and how long one stream may stay open
+# (each open stream holds a worker, so screens reconnect periodically)
+TV_STREAM_INTERVAL = float(os.environ.get('TV_STREAM_INTERVAL', 1))
+TV_STREAM_HEARTBEAT = float(os.environ.get('TV_STREAM_HEARTBEAT', 15))
+TV_STREAM_MAX_SECONDS = float(os.environ.get('TV_STREAM_MAX_SECONDS', 120))
+
+# Versioned queue changes behind /api/queue/changes, fed by every queue reload
+queue_log = QueueChangeLog(int(os.environ.get('QUEUE_CHANGE_LOG_SIZE', 1000)))
+
+# In-memory copy of the active queue that serves queue reads; handlers write
+# through to it after committing, and the reconcile thread repairs drift from
+# writes made by other workers or directly in MySQL every QUEUE_RECONCILE_SECONDS.
+# Students are called in weighted round-robin order across payment lanes
+# (QUEUE_LANE_WEIGHTS), with priority users boosted and long waits aged ahead
+queue_engine = QueueEngine(db_pool, lanes=LaneScheduler(LanePolicy(
+    parse_weights(os.environ.get('QUEUE_LANE_WEIGHTS', DEFAULT_LANE_WEIGHTS)),
+    priority_boost=timedelta(minutes=float(os.environ.get('QUEUE_PRIORITY_BOOST_MINUTES', 30))),
+    aging=timedelta(minutes=float(os.environ.get('QUEUE_AGING_MINUTES', 60)))
+)))
+QUEUE_RECONCILE_SECONDS = float(os.environ.get('QUEUE_RECONCILE_SECONDS', 10))
+
+# Per-lane, per-hour service times from transaction_history behind the wait
+# estimates of /api/queue/my_position, topped up every SERVICE_TIMES_REFRESH_SECONDS
+service_times = ServiceTimeStats(
+    default_seconds=float(os.environ.get('SERVICE_TIME_DEFAULT_SECONDS', 300)),
+    max_gap=timedelta(minutes=float(os.environ.get('SERVICE_TIME_MAX_GAP_MINUTES', 30))),
+    history_days=int(os.environ.get('SERVICE_TIME_HISTORY_DAYS', 28))
+)
+SERVICE_TIMES_REFRESH_SECONDS = float(os.environ.get('SERVICE_TIMES_REFRESH_SECONDS', 300))
+
+# Background jobs (jobs.py). Leader-only jobs run in the one process holding the
+# lease: a MySQL named lock under WSGI, or a lock file when server.py is run directly
+JOB_LEADER_LOCK = os.environ.get('JOB_LEADER_LOCK', 'aisat_registral_jobs')
+JOB_LOCK_FILE = os.environ.get('JOB_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'aisat_registral_jobs.lock'))
+if os.environ.get('JOB_LEASE', 'file' if __name__ == '__main__' else 'mysql') == 'file':
+    job_lease = FileLease(JOB_LOCK_FILE)
+else:
+    job_lease = MySQLLease(lambda: mysql.connector.connect(**db_pool.config), JOB_LEADER_LOCK)
+job_scheduler = JobScheduler(job_lease)
+
+# On-call timers: calling a student stores an absolute call_deadline and the
+# auto-reject job runs when the earliest one passes (or every AUTO_REJECT_INTERVAL
+# seconds at most). While anyone is on call the TV queue is refreshed every
+# CALL_COUNTDOWN_REFRESH seconds so countdowns move
+call_timer = DeadlineTimer(on_change=lambda: job_scheduler.run_soon('auto_reject'))
+AUTO_REJECT_INTERVAL = float(os.environ.get('AUTO_REJECT_INTERVAL', 60))
+CALL_COUNTDOWN_REFRESH = float(os.environ.get('CALL_COUNTDOWN_REFRESH', 60))
+
+# Generated request ids: sequential per appointment day and payment lane, from
+# blocks of TICKET_BLOCK_SIZE numbers each worker reserves in ticket_sequences
+ticket_allocator = TicketAllocator(db_pool, int(os.environ.get('TICKET_BLOCK_SIZE', 10)))
+
+# Places per appointment slot (SLOT_MINUTES long, see slots.py) that have no
+# row in slot_capacity; empty means no limit
+SLOT_DEFAULT_CAPACITY = int(os.environ['SLOT_DEFAULT_CAPACITY']) if os.environ.get('SLOT_DEFAULT_CAPACITY') else None
+# Longest range /api/slots/availability answers for
+SLOT_AVAILABILITY_MAX_DAYS = 62
+
 # Dictionary to store verification codes with timestamps
 verification_codes = {}
 
@@ -64,20 +156,76 @@ def serve_images(filename):
     return send_from_directory('img', filename)
 # -------------------------
 
-DB_CONFIG = {
-    "host": "jimboyaczon.mysql.pythonanywhere-services.com",
-    "user": "jimboyaczon",
-    "password": "fk9lratv",
-    "database": "jimboyaczon$aisat-registral-db"
-}
-
-
 def get_db_connection():
+    """Borrow a pooled connection; conn.close() returns it to the pool"""
     try:
-        return mysql.connector.connect(**DB_CONFIG)
-    except mysql.connector.Error as e:
+        conn = db_pool.acquire()
+    except (mysql.connector.Error, PoolTimeout) as e:
         print(f"Database connection error: {e}")
         return None
+    if has_request_context():
+        # Remember the connection so it goes back to the pool even if a handler forgets
+        g.setdefault('db_connections', []).append(conn)
+    return conn
+
+@app.teardown_request
+def release_db_connections(exc):
+    for conn in g.pop('db_connections', []):
+        if conn.is_connected():
+            conn.close()
+
+def content_etag(body):
+    """Strong ETag for an encoded response body"""
+    return hashlib.sha1(body).hexdigest()
+
+def file_etag(path):
+    """ETag from a file's size and modification time, so unchanged files aren't read"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return "missing"
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+def conditional_json_response(body, etag=None):
+    """JSON response with a strong ETag, turned into a 304 when the client's copy matches"""
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag or content_etag(body))
+    # Let clients keep the body but check back with the server every time
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def not_modified(etag):
+    """True when the request's If-None-Match already names `etag`"""
+    return request.if_none_match.contains(etag)
+
+def encode_with_etag(payload):
+    body = dumps(payload)
+    return body, content_etag(body)
+
+def cached_json_response(key, loader):
+    """Serve a JSON payload from tv_cache, calling loader() only on a miss"""
+    try:
+        body, etag = tv_cache.get(key, lambda: encode_with_etag(loader()))
+    except Exception as e:
+        print(f"Error loading {key}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    return conditional_json_response(body, etag)
+
+# Bring the schema up to date once per process instead of probing it in handlers
+if os.environ.get('RUN_MIGRATIONS', '1') == '1':
+    try:
+        applied = run_migrations()
+        if applied:
+            print(f"Applied schema migrations: {applied}")
+    except Exception as e:
+        print(f"Schema migration failed: {e}")
+
+try:
+    print(f"Queue engine loaded {queue_engine.load()} active requests")
+    call_timer.reset(queue_engine.call_deadlines())
+except Exception as e:
+    # Reads retry the load, so a database that is down at start-up isn't fatal
+    print(f"Queue engine load failed: {e}")
 
 def token_required(f):
     @wraps(f)
@@ -261,57 +409,101 @@ def register_user_by_admin():
         if conn and conn.is_connected():
             conn.close()
 
+def with_positions(requests_processed):
+    """Add each request's place in the calling order (null once it is on call, or booked for later)"""
+    positions = queue_engine.positions()
+    for req in requests_processed:
+        req["position"] = positions.get(int(req["id"]))
+    return requests_processed
+
+# Queue rows as returned to the admin panel
+PENDING_REQUEST_ROW = RowSchema([
+    ("id", "str"), ("idno", "str"), ("name", "str"), ("email", "str"), ("level", "str"),
+    ("method", "str"), ("payment", "str"), ("status", "str"), ("counter", "minutes_left", "call_deadline"),
+    ("request_id", "str"), ("schedule", "datetime")
+])
+
 @app.route('/api/pending_requests', methods=['GET'])
 @token_required
 def get_pending_requests():
     if not g.user.get('is_admin'):
         return jsonify({"error": "Unauthorized"}), 401
-    conn, cursor = None, None
     try:
-        conn = get_db_connection()
-        if not conn:
-             return jsonify({"error": "Database connection failed"}), 500
-        cursor = conn.cursor(dictionary=True)
-        # Use the actual field names from the schema
-        cursor.execute("SELECT id, idno, name, email, level, method, payment, schedule, status, counter, request_id FROM users WHERE status IN ('pending', 'oncall') ORDER BY schedule ASC")
-        users_raw = cursor.fetchall()
-        
-        # Manually build a new list of dictionaries to ensure data is clean for JSON
-        users_processed = []
-        for user_row in users_raw:
-            processed_user = {
-                "id": str(user_row["id"]) if user_row["id"] is not None else "",
-                "idno": str(user_row["idno"]) if user_row["idno"] is not None else "",
-                "name": str(user_row["name"]) if user_row["name"] is not None else "",
-                "email": str(user_row["email"]) if user_row["email"] is not None else "",
-                "level": str(user_row["level"]) if user_row["level"] is not None else "",
-                "method": str(user_row["method"]) if user_row["method"] is not None else "",
-                "payment": str(user_row["payment"]) if user_row["payment"] is not None else "",
-                "status": str(user_row["status"]) if user_row["status"] is not None else "",
-                "counter": int(user_row["counter"]) if user_row["counter"] is not None else None,
-                "request_id": str(user_row["request_id"]) if user_row["request_id"] is not None else "",
-                "schedule": None  # Default to None
-            }
-            
-            # Handle datetime conversion safely
-            schedule = user_row["schedule"]
-            if schedule:
-                if isinstance(schedule, datetime):
-                    processed_user['schedule'] = schedule.isoformat()
-                else:
-                    # Try to convert to string if it's not a datetime object
-                    processed_user['schedule'] = str(schedule)
-                    
-            users_processed.append(processed_user)
-            
-        return jsonify(users_processed)
+        queue_engine.ensure_loaded()
+        return json_response(with_positions(PENDING_REQUEST_ROW.many(queue_engine.active())))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if conn and conn.is_connected():
-            conn.close()
+
+# Rejected and scheduled requests (no counter)
+REQUEST_ROW = RowSchema([
+    ("id", "str"), ("idno", "str"), ("name", "str"), ("email", "str"), ("level", "str"),
+    ("method", "str"), ("payment", "str"), ("status", "str"), ("request_id", "str"),
+    ("schedule", "datetime")
+])
+
+# Request state lives in the requests table. Endpoints address requests by the
+# student's user id and act on that student's latest request; a student has at
+# most one open (pending or on-call) request, and booking again while it is open
+# rebooks it instead of starting another
+OPEN_STATUSES = ('pending', 'oncall')
+
+def current_request_ids(cursor, user_ids):
+    """requests.id of each user's latest request"""
+    if not user_ids:
+        return []
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    cursor.execute(f"SELECT MAX(id) AS id FROM requests WHERE user_id IN ({placeholders}) GROUP BY user_id",
+                   tuple(user_ids))
+    return [row['id'] if isinstance(row, dict) else row[0] for row in cursor.fetchall()]
+
+def move_slot_places(cursor, current, new_status, new_schedule=None):
+    """Keep slot_counts in step with requests `current` ([(status, schedule)]) changing status
+
+    Open requests hold a place in their slot: one leaving OPEN_STATUSES gives
+    it back, one entering them takes one (past capacity: admins may restore or
+    reschedule into a full slot), and new_schedule moves it. Returns True when
+    any count changed.
+    """
+    changed = False
+    for old_status, old_schedule in current:
+        was_open, is_open = old_status in OPEN_STATUSES, new_status in OPEN_STATUSES
+        if was_open and old_schedule is not None and (not is_open or new_schedule is not None):
+            release_slot(cursor, old_schedule)
+            changed = True
+        schedule = new_schedule or old_schedule
+        if is_open and schedule is not None and (not was_open or new_schedule is not None):
+            reserve_slot(cursor, schedule, enforce=False)
+            changed = True
+    return changed
+
+def book_request(cursor, user_id, level, schedule, method, payment, request_id):
+    """Queue a request for user_id: rebook their open request, or start a new one
+
+    Takes a place in the slot of `schedule` (a datetime) first and returns False,
+    having written nothing, when that slot is full.
+    """
+    cursor.execute("SELECT id, status, schedule FROM requests WHERE user_id = %s ORDER BY id DESC LIMIT 1 FOR UPDATE",
+                   (user_id,))
+    latest = cursor.fetchone()
+    if isinstance(latest, dict):
+        latest = (latest['id'], latest['status'], latest['schedule'])
+    rebook = latest is not None and latest[1] in OPEN_STATUSES
+    if rebook:
+        # Give back the old place first so moving within a full slot still works
+        release_slot(cursor, latest[2])
+    if not reserve_slot(cursor, schedule, default_capacity=SLOT_DEFAULT_CAPACITY):
+        return False
+    if rebook:
+        cursor.execute(
+            "UPDATE requests SET level=%s, schedule=%s, method=%s, payment=%s, status='pending', request_id=%s WHERE id=%s",
+            (level, schedule, method, payment, request_id, latest[0])
+        )
+    else:
+        cursor.execute(
+            "INSERT INTO requests (user_id, level, schedule, method, payment, status, request_id) VALUES (%s, %s, %s, %s, %s, 'pending', %s)",
+            (user_id, level, schedule, method, payment, request_id)
+        )
+    return True
 
 @app.route('/api/rejected_requests', methods=['GET'])
 @token_required
@@ -324,36 +516,14 @@ def get_rejected_requests():
         if not conn:
              return jsonify({"error": "Database connection failed"}), 500
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, idno, name, email, level, method, payment, schedule, status, request_id FROM users WHERE status = 'rejected' ORDER BY schedule DESC")
-        users_raw = cursor.fetchall()
-        
-        users_processed = []
-        for user_row in users_raw:
-            processed_user = {
-                "id": str(user_row["id"]) if user_row["id"] is not None else "",
-                "idno": str(user_row["idno"]) if user_row["idno"] is not None else "",
-                "name": str(user_row["name"]) if user_row["name"] is not None else "",
-                "email": str(user_row["email"]) if user_row["email"] is not None else "",
-                "level": str(user_row["level"]) if user_row["level"] is not None else "",
-                "method": str(user_row["method"]) if user_row["method"] is not None else "",
-                "payment": str(user_row["payment"]) if user_row["payment"] is not None else "",
-                "status": str(user_row["status"]) if user_row["status"] is not None else "",
-                "request_id": str(user_row["request_id"]) if user_row["request_id"] is not None else "",
-                "schedule": None  # Default to None
-            }
-            
-            # Handle datetime conversion safely
-            schedule = user_row["schedule"]
-            if schedule:
-                if isinstance(schedule, datetime):
-                    processed_user['schedule'] = schedule.isoformat()
-                else:
-                    # Try to convert to string if it's not a datetime object
-                    processed_user['schedule'] = str(schedule)
-                    
-            users_processed.append(processed_user)
-
-        return jsonify(users_processed)
+        # Only students whose latest request was rejected; one that booked again has moved on
+        cursor.execute("""
+            SELECT u.id, u.idno, u.name, u.email, r.level, r.method, r.payment, r.schedule, r.status, r.request_id
+            FROM requests r JOIN users u ON u.id = r.user_id
+            WHERE r.status = 'rejected' AND r.id = (SELECT MAX(id) FROM requests WHERE user_id = r.user_id)
+            ORDER BY r.schedule DESC
+        """)
+        return json_response(REQUEST_ROW.many(cursor.fetchall()))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -383,13 +553,24 @@ def update_status():
              return jsonify({"error": "Database connection failed"}), 500
         cursor = conn.cursor()
         
-        placeholders = ','.join(['%s'] * len(user_ids))
+        request_ids = current_request_ids(cursor, user_ids)
+        if not request_ids:
+            return jsonify({"message": "0 user(s) updated"})
+        placeholders = ','.join(['%s'] * len(request_ids))
+        
+        # A request leaving on-call drops its timer
+        deadline_clause = "" if new_status == 'oncall' else ", call_deadline = NULL"
+        
+        # Open requests hold a slot place, which moves with the status and schedule
+        cursor.execute(f"SELECT status, schedule FROM requests WHERE id IN ({placeholders})",
+                       tuple(request_ids))
+        current = cursor.fetchall()
         
         # Handle different update scenarios
         if new_status is None:
             # Delete/clear the status
-            sql = f"UPDATE users SET status = NULL WHERE id IN ({placeholders})"
-            cursor.execute(sql, tuple(user_ids))
+            sql = f"UPDATE requests SET status = NULL{deadline_clause} WHERE id IN ({placeholders})"
+            cursor.execute(sql, tuple(request_ids))
         elif new_schedule:
             # Format the datetime properly for MySQL
             # If it's an ISO string, convert it to MySQL datetime format
@@ -399,20 +580,31 @@ def update_status():
                 formatted_datetime = parsed_datetime.strftime('%Y-%m-%d %H:%M:%S')
                 
                 # Update both status and schedule (for recalling rejected requests)
-                sql = f"UPDATE users SET status = %s, schedule = %s WHERE id IN ({placeholders})"
-                cursor.execute(sql, tuple([new_status, formatted_datetime] + user_ids))
+                sql = f"UPDATE requests SET status = %s, schedule = %s{deadline_clause} WHERE id IN ({placeholders})"
+                cursor.execute(sql, tuple([new_status, formatted_datetime] + request_ids))
             except ValueError as e:
                 # If there's an error parsing the datetime, return an error
                 return jsonify({"error": f"Invalid datetime format: {str(e)}"}), 400
         else:
             # Just update status
-            sql = f"UPDATE users SET status = %s WHERE id IN ({placeholders})"
-            cursor.execute(sql, tuple([new_status] + user_ids))
+            sql = f"UPDATE requests SET status = %s{deadline_clause} WHERE id IN ({placeholders})"
+            cursor.execute(sql, tuple([new_status] + request_ids))
         
+        updated = cursor.rowcount
+        moved = new_status is not None and bool(new_schedule)
+        slots_changed = move_slot_places(cursor, current, new_status, parsed_datetime if moved else None)
         conn.commit()
+        cleared = {} if new_status == 'oncall' else {"call_deadline": None}
+        if new_status is not None and new_schedule:
+            queue_engine.apply(cursor, user_ids, status=new_status, schedule=formatted_datetime, **cleared)
+        else:
+            queue_engine.apply(cursor, user_ids, status=new_status, **cleared)
+        tv_cache.invalidate('tv_pending_requests')
+        if slots_changed:
+            tv_cache.invalidate('slots')
         
         status_desc = "deleted" if new_status is None else f"updated to '{new_status}'"
-        return jsonify({"message": f"{cursor.rowcount} user(s) {status_desc}"})
+        return jsonify({"message": f"{updated} user(s) {status_desc}"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -432,7 +624,7 @@ def create_appointment():
     payment = data.get('payment')
     method = data.get('method')
     date = data.get('date')
-    time = data.get('time')
+    appointment_time = data.get('time')
     request_id = data.get('request_id')  # Get request_id if provided from client
     
     # Check if we should preserve course/strand
@@ -441,7 +633,7 @@ def create_appointment():
     strand = data.get('strand', '')
     
     # Validate required fields
-    if not all([level, req_type, payment, method, date, time]):
+    if not all([level, req_type, payment, method, date, appointment_time]):
         return jsonify({"error": "Missing required fields"}), 400
     
     # Validate enum values
@@ -457,6 +649,11 @@ def create_appointment():
     
     if method not in valid_methods:
         return jsonify({"error": f"Invalid method. Must be one of: {', '.join(valid_methods)}"}), 400
+    
+    try:
+        schedule = parse_schedule(f"{date} {appointment_time}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
         
     conn, cursor = None, None
     try:
@@ -464,25 +661,25 @@ def create_appointment():
         if not conn:
             return jsonify({"error": "Database connection failed"}), 500
         cursor = conn.cursor()
-        schedule_datetime = f"{date} {time}"
         
-        # Generate a request ID if not provided
+        # Generate a request ID if not provided: the next ticket in the payment lane for that day
         if not request_id:
-            # First letter of payment type + random 4-digit number
-            first_letter = payment[0].upper()
-            random_num = str(1000 + int(1000 * time.time() % 9000)).zfill(4)
-            request_id = f"{first_letter}-{random_num}"
+            request_id = ticket_allocator.allocate(payment, schedule.date())
         
         # If preserve_course_strand flag is set, use the provided course/strand values
         # Otherwise, use req_type for both (original behavior)
         course_value = course if preserve_course_strand else req_type
         strand_value = strand if preserve_course_strand else req_type
         
-        sql = "UPDATE users SET level=%s, course=%s, strand=%s, schedule=%s, method=%s, payment=%s, status='pending', request_id=%s WHERE id=%s"
-        params = (level, course_value, strand_value, schedule_datetime, method, payment, request_id, user_id)
-        
-        cursor.execute(sql, params)
+        cursor.execute("UPDATE users SET level=%s, course=%s, strand=%s WHERE id=%s",
+                       (level, course_value, strand_value, user_id))
+        if not book_request(cursor, user_id, level, schedule, method, payment, request_id):
+            conn.rollback()
+            return jsonify({"error": "That time slot is fully booked"}), 409
         conn.commit()
+        queue_engine.refresh(cursor, [user_id])
+        tv_cache.invalidate('tv_pending_requests')
+        tv_cache.invalidate('slots')
         
         return jsonify({
             "success": True, 
@@ -498,14 +695,13 @@ def create_appointment():
         if conn and conn.is_connected():
             conn.close()
 
-@app.route('/api/calendar', methods=['GET'])
-def get_calendar():
-    """Get all calendar entries"""
+def load_calendar():
+    """Date -> status map of every calendar entry"""
     conn, cursor = None, None
     try:
         conn = get_db_connection()
         if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
+            raise RuntimeError("Database connection failed")
         
         cursor = conn.cursor(dictionary=True)
         cursor.execute("SELECT date, status FROM schedule")
@@ -517,16 +713,18 @@ def get_calendar():
                 date_str = entry['date'].strftime('%Y-%m-%d')
                 calendar_data[date_str] = entry.get('status')
         
-        return jsonify(calendar_data)
-    
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return calendar_data
     finally:
         if cursor:
             cursor.close()
         if conn and conn.is_connected():
             conn.close()
 
+@app.route('/api/calendar', methods=['GET'])
+def get_calendar():
+    """Get all calendar entries"""
+    return cached_json_response('calendar', load_calendar)
+
 @app.route('/api/user_profile', methods=['GET'])
 @token_required
 def get_user_profile():
@@ -543,7 +741,12 @@ def get_user_profile():
             return jsonify({"error": "Database connection failed"}), 500
         
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, name, email, cell, idno, level, course, strand, request_id, status FROM users WHERE id = %s", (user_id,))
+        cursor.execute("""
+            SELECT u.id, u.name, u.email, u.cell, u.idno, u.level, u.course, u.strand, r.request_id, r.status
+            FROM users u
+            LEFT JOIN requests r ON r.id = (SELECT MAX(id) FROM requests WHERE user_id = u.id)
+            WHERE u.id = %s
+        """, (user_id,))
         user = cursor.fetchone()
         
         if not user:
@@ -660,6 +863,9 @@ def update_calendar():
             cursor.execute("INSERT INTO schedule (date, time, status) VALUES (%s, %s, %s)", (date_obj, "00:00:00", status))
         
         conn.commit()
+        tv_cache.invalidate('calendar')
+        # Full and unavailable days take no bookings
+        tv_cache.invalidate('slots')
         
         return jsonify({"success": True, "date": date_str, "status": status})
     
@@ -671,6 +877,98 @@ def update_calendar():
         if conn and conn.is_connected():
             conn.close()
 
+def load_slot_availability(start, end):
+    """Remaining places per slot for each day from start to end, from the maintained counts"""
+    conn, cursor = None, None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        
+        cursor = conn.cursor()
+        return {
+            "slot_minutes": SLOT_MINUTES,
+            "days": availability(cursor, start, end, default_capacity=SLOT_DEFAULT_CAPACITY)
+        }
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+@app.route('/api/slots/availability', methods=['GET'])
+def get_slot_availability():
+    """Capacity, bookings and remaining places per slot for ?from=YYYY-MM-DD&to=YYYY-MM-DD"""
+    try:
+        start = datetime.strptime(request.args.get('from') or datetime.now().strftime('%Y-%m-%d'), '%Y-%m-%d').date()
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else start + timedelta(days=13)
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+    if end < start or (end - start).days >= SLOT_AVAILABILITY_MAX_DAYS:
+        return jsonify({"error": f"to must be on or after from, at most {SLOT_AVAILABILITY_MAX_DAYS} days later"}), 400
+    
+    return cached_json_response(f"slots:{start}:{end}", lambda: load_slot_availability(start, end))
+
+@app.route('/api/admin/slot-capacity', methods=['GET', 'POST'])
+@token_required
+def slot_capacity_config():
+    """Weekly slot capacity template: list it, or set/clear slots (admin only)"""
+    if not g.user.get('is_admin'):
+        return jsonify({"error": "Admin privileges required"}), 403
+    
+    changes = []
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        slots = data.get('slots')
+        if not isinstance(slots, list) or not slots:
+            return jsonify({"error": "slots must be a non-empty list"}), 400
+        for slot in slots:
+            try:
+                weekday = int(slot['weekday'])
+                slot_time = datetime.strptime(slot['time'], '%H:%M')
+                capacity = None if slot.get('capacity') is None else int(slot['capacity'])
+            except (KeyError, TypeError, ValueError):
+                return jsonify({"error": "Each slot needs weekday (0-6), time (HH:MM) and capacity (number or null)"}), 400
+            if not 0 <= weekday <= 6 or (capacity is not None and capacity < 0):
+                return jsonify({"error": "weekday must be 0-6 (Monday first) and capacity at least 0"}), 400
+            # Times inside a slot configure the slot they fall in
+            changes.append((weekday, slot_of(slot_time)[1], capacity))
+    
+    conn, cursor = None, None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
+        
+        cursor = conn.cursor()
+        for weekday, slot_time, capacity in changes:
+            if capacity is None:
+                cursor.execute("DELETE FROM slot_capacity WHERE weekday = %s AND slot_time = %s", (weekday, slot_time))
+            else:
+                cursor.execute("""
+                    INSERT INTO slot_capacity (weekday, slot_time, capacity) VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE capacity = VALUES(capacity)
+                """, (weekday, slot_time, capacity))
+        if changes:
+            conn.commit()
+            tv_cache.invalidate('slots')
+        
+        cursor.execute("SELECT weekday, slot_time, capacity FROM slot_capacity ORDER BY weekday, slot_time")
+        template = [{
+            "weekday": weekday,
+            "time": as_time(slot_time).strftime('%H:%M'),
+            "capacity": capacity
+        } for weekday, slot_time, capacity in cursor.fetchall()]
+        
+        return jsonify({"slot_minutes": SLOT_MINUTES, "default_capacity": SLOT_DEFAULT_CAPACITY, "slots": template})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
 @app.route('/api/auth/create_public_user', methods=['POST'])
 @token_required
 def create_public_user():
@@ -757,19 +1055,7 @@ def get_admin_profile():
             return jsonify({"error": "Database connection failed"}), 500
         
         cursor = conn.cursor(dictionary=True)
-        
-        # First check if is_active column exists
-        cursor.execute("SHOW COLUMNS FROM admins LIKE 'is_active'")
-        is_active_exists = cursor.fetchone() is not None
-        
-        # Construct the query based on available columns
-        if is_active_exists:
-            # If is_active exists, include it in the query
-            cursor.execute("SELECT id, full_name, email, id_no, contact_no, room_name, is_active FROM admins WHERE id = %s", (user_id,))
-        else:
-            # Otherwise, select without is_active
-            cursor.execute("SELECT id, full_name, email, id_no, contact_no, room_name FROM admins WHERE id = %s", (user_id,))
-        
+        cursor.execute("SELECT id, full_name, email, id_no, contact_no, room_name, is_active FROM admins WHERE id = %s", (user_id,))
         admin = cursor.fetchone()
         
         if not admin:
@@ -782,15 +1068,10 @@ def get_admin_profile():
             "email": str(admin.get("email", "")) if admin.get("email") is not None else "",
             "id_no": str(admin.get("id_no", "")) if admin.get("id_no") is not None else "",
             "contact_no": str(admin.get("contact_no", "")) if admin.get("contact_no") is not None else "",
-            "room_name": str(admin.get("room_name", "")) if admin.get("room_name") is not None else ""
+            "room_name": str(admin.get("room_name", "")) if admin.get("room_name") is not None else "",
+            "is_active": str(admin.get("is_active", "no")) if admin.get("is_active") is not None else "no"
         }
         
-        # Add is_active if it exists
-        if is_active_exists:
-            admin_data["is_active"] = str(admin.get("is_active", "no")) if admin.get("is_active") is not None else "no"
-        else:
-            admin_data["is_active"] = "yes"  # Default to yes if the column doesn't exist
-        
         return jsonify(admin_data)
     
     except Exception as e:
@@ -865,6 +1146,7 @@ def update_admin_profile():
             )
         
         conn.commit()
+        tv_cache.invalidate('active_admins')
         
         return jsonify({"success": True, "message": "Profile updated successfully"})
     
@@ -876,6 +1158,12 @@ def update_admin_profile():
         if conn and conn.is_connected():
             conn.close()
 
+# Student accounts as listed in the admin panel
+USER_ROW = RowSchema([
+    ("id", "str"), ("idno", "str"), ("name", "str"), ("email", "str"),
+    ("level", "str"), ("course", "str"), ("strand", "str")
+])
+
 @app.route('/api/users', methods=['GET'])
 @token_required
 def get_users():
@@ -891,24 +1179,7 @@ def get_users():
         
         cursor = conn.cursor(dictionary=True)
         cursor.execute("SELECT id, idno, name, email, level, course, strand FROM users ORDER BY idno")
-        users_raw = cursor.fetchall()
-        
-        # Process the results
-        users = []
-        for user in users_raw:
-            # Convert values to strings and handle None
-            processed_user = {
-                "id": str(user["id"]) if user["id"] is not None else "",
-                "idno": str(user["idno"]) if user["idno"] is not None else "",
-                "name": str(user["name"]) if user["name"] is not None else "",
-                "email": str(user["email"]) if user["email"] is not None else "",
-                "level": str(user["level"]) if user["level"] is not None else "",
-                "course": str(user["course"]) if user["course"] is not None else "",
-                "strand": str(user["strand"]) if user["strand"] is not None else ""
-            }
-            users.append(processed_user)
-        
-        return jsonify(users)
+        return json_response(USER_ROW.many(cursor.fetchall()))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -962,6 +1233,8 @@ def update_user():
         )
         
         conn.commit()
+        queue_engine.apply(cursor, [user_id], name=name, email=email, level=level)
+        tv_cache.invalidate('tv_pending_requests')
         
         return jsonify({"success": True, "message": "User updated successfully"})
     except Exception as e:
@@ -986,6 +1259,11 @@ def update_counter():
     if not user_id or counter is None:
         return jsonify({"error": "Missing required fields"}), 400
     
+    try:
+        minutes = int(counter)
+    except (TypeError, ValueError):
+        return jsonify({"error": "counter must be a whole number of minutes"}), 400
+    
     conn, cursor = None, None
     try:
         conn = get_db_connection()
@@ -994,9 +1272,17 @@ def update_counter():
         
         cursor = conn.cursor()
         
-        # Update user counter
-        cursor.execute("UPDATE users SET counter = %s WHERE id = %s", (counter, user_id))
+        # Restart the user's timer: counter is the minutes left from now
+        call_deadline = datetime.now().replace(microsecond=0) + timedelta(minutes=minutes)
+        request_ids = current_request_ids(cursor, [user_id])
+        if not request_ids:
+            return jsonify({"error": "Request not found"}), 404
+        cursor.execute("UPDATE requests SET counter = %s, call_deadline = %s WHERE id = %s",
+                       (minutes, call_deadline, request_ids[0]))
         conn.commit()
+        queue_engine.apply(cursor, [user_id], counter=minutes, call_deadline=call_deadline)
+        call_timer.arm(int(user_id), call_deadline)
+        tv_cache.invalidate('tv_pending_requests')
         
         return jsonify({"success": True, "message": "Counter updated successfully"})
     except Exception as e:
@@ -1090,6 +1376,12 @@ def user_login():
         if conn and conn.is_connected():
             conn.close()
 
+# Queue rows visible to students, without contact details
+PUBLIC_REQUEST_ROW = RowSchema([
+    ("id", "str"), ("name", "str"), ("level", "str"), ("status", "str"), ("counter", "minutes_left", "call_deadline"),
+    ("request_id", "str"), ("schedule", "datetime"), ("user_id", "str", "id")
+])
+
 @app.route('/api/user/requests', methods=['GET'])
 @token_required
 def get_user_requests():
@@ -1099,119 +1391,31 @@ def get_user_requests():
     if not user_id:
         return jsonify({"error": "User ID not found in token"}), 400
     
-    conn, cursor = None, None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-        
-        cursor = conn.cursor(dictionary=True)
+        queue_engine.ensure_loaded()
         
-        # Get all pending and on-call requests (limited information for security)
-        cursor.execute("""
-            SELECT id, name, level, schedule, status, counter, request_id
-            FROM users 
-            WHERE status IN ('pending', 'oncall')
-            ORDER BY schedule ASC
-            LIMIT 50
-        """)
-        
-        requests_raw = cursor.fetchall()
-        
-        # Process the results
-        requests_processed = []
-        for req in requests_raw:
-            processed_req = {
-                "id": str(req["id"]) if req["id"] is not None else "",
-                "name": str(req["name"]) if req["name"] is not None else "",
-                "level": str(req["level"]) if req["level"] is not None else "",
-                "status": str(req["status"]) if req["status"] is not None else "",
-                "counter": int(req["counter"]) if req["counter"] is not None else None,
-                "request_id": str(req["request_id"]) if req["request_id"] is not None else "",
-                "schedule": None,
-                "user_id": str(req["id"]) if req["id"] is not None else "",  # Add user_id field
-                "is_current_user": str(req["id"]) == user_id  # Add flag to easily identify current user's requests
-            }
-            
-            # Handle datetime conversion safely
-            schedule = req["schedule"]
-            if schedule:
-                if isinstance(schedule, datetime):
-                    processed_req['schedule'] = schedule.isoformat()
-                else:
-                    processed_req['schedule'] = str(schedule)
-            
-            requests_processed.append(processed_req)
+        # Pending and on-call requests (limited information for security)
+        requests_processed = with_positions(PUBLIC_REQUEST_ROW.many(queue_engine.active()[:50]))
+        for req in requests_processed:
+            # Flag to easily identify the current user's requests
+            req["is_current_user"] = req["id"] == user_id
         
-        return jsonify(requests_processed)
+        return json_response(requests_processed)
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if conn and conn.is_connected():
-            conn.close()
 
 @app.route('/api/scheduled_requests', methods=['GET'])
 @token_required
 def get_scheduled_requests():
     if not g.user.get('is_admin'):
         return jsonify({"error": "Unauthorized"}), 401
-    conn, cursor = None, None
     try:
-        conn = get_db_connection()
-        if not conn:
-             return jsonify({"error": "Database connection failed"}), 500
-        cursor = conn.cursor(dictionary=True)
-        
-        # Get current date and time
-        now = datetime.now()
-        
-        # Get users with pending status and future schedule date
-        cursor.execute("""
-            SELECT id, idno, name, email, level, method, payment, schedule, status, request_id 
-            FROM users 
-            WHERE status = 'pending' AND schedule > %s
-            ORDER BY schedule ASC
-        """, (now,))
-        
-        users_raw = cursor.fetchall()
-        
-        users_processed = []
-        for user_row in users_raw:
-            processed_user = {
-                "id": str(user_row["id"]) if user_row["id"] is not None else "",
-                "idno": str(user_row["idno"]) if user_row["idno"] is not None else "",
-                "name": str(user_row["name"]) if user_row["name"] is not None else "",
-                "email": str(user_row["email"]) if user_row["email"] is not None else "",
-                "level": str(user_row["level"]) if user_row["level"] is not None else "",
-                "method": str(user_row["method"]) if user_row["method"] is not None else "",
-                "payment": str(user_row["payment"]) if user_row["payment"] is not None else "",
-                "status": str(user_row["status"]) if user_row["status"] is not None else "",
-                "request_id": str(user_row["request_id"]) if user_row["request_id"] is not None else "",
-                "schedule": None  # Default to None
-            }
-            
-            # Handle datetime conversion safely
-            schedule = user_row["schedule"]
-            if schedule:
-                if isinstance(schedule, datetime):
-                    processed_user['schedule'] = schedule.isoformat()
-                else:
-                    # Try to convert to string if it's not a datetime object
-                    processed_user['schedule'] = str(schedule)
-                    
-            users_processed.append(processed_user)
-
-        return jsonify(users_processed)
+        queue_engine.ensure_loaded()
+        # Pending requests scheduled for later than now
+        return json_response(REQUEST_ROW.many(queue_engine.scheduled_after(datetime.now())))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if conn and conn.is_connected():
-            conn.close()
 
 @app.route('/api/call_student/<int:user_id>', methods=['POST'])
 @token_required
@@ -1221,7 +1425,12 @@ def call_student(user_id):
     
     data = request.get_json()
     status = data.get('status', 'oncall')
-    counter = data.get('counter', 30)  # Default 30 minutes
+    counter = data.get('counter', 30)  # Default 30 minutes; null calls without a time limit
+    
+    try:
+        minutes = None if counter is None else int(counter)
+    except (TypeError, ValueError):
+        return jsonify({"error": "counter must be a whole number of minutes"}), 400
     
     conn, cursor = None, None
     try:
@@ -1230,13 +1439,30 @@ def call_student(user_id):
              return jsonify({"error": "Database connection failed"}), 500
         cursor = conn.cursor()
         
-        # Update the user status to oncall and set counter
+        # Update the user status to oncall and start the timer, if there is one
+        call_deadline = None
+        if minutes is not None:
+            call_deadline = datetime.now().replace(microsecond=0) + timedelta(minutes=minutes)
+        request_ids = current_request_ids(cursor, [user_id])
+        if not request_ids:
+            return jsonify({"error": "Request not found"}), 404
+        cursor.execute("SELECT status, schedule FROM requests WHERE id = %s", (request_ids[0],))
+        current = cursor.fetchall()
         cursor.execute(
-            "UPDATE users SET status = %s, counter = %s WHERE id = %s",
-            (status, counter, user_id)
+            "UPDATE requests SET status = %s, counter = %s, call_deadline = %s WHERE id = %s",
+            (status, minutes, call_deadline, request_ids[0])
         )
+        slots_changed = move_slot_places(cursor, current, status)
         
         conn.commit()
+        queue_engine.apply(cursor, [user_id], status=status, counter=minutes, call_deadline=call_deadline)
+        if call_deadline is None:
+            call_timer.disarm(user_id)
+        else:
+            call_timer.arm(user_id, call_deadline)
+        tv_cache.invalidate('tv_pending_requests')
+        if slots_changed:
+            tv_cache.invalidate('slots')
         
         return jsonify({"success": True, "message": "Student called successfully"})
     except Exception as e:
@@ -1247,31 +1473,189 @@ def call_student(user_id):
         if conn and conn.is_connected():
             conn.close()
 
-@app.route('/api/delete_scheduled_request/<int:user_id>', methods=['DELETE'])
+@app.route('/api/queue/order', methods=['GET'])
 @token_required
-def delete_scheduled_request(user_id):
+def get_queue_order():
+    """Pending requests that are due, in the order they will be called, with the scheduling policy"""
+    try:
+        queue_engine.ensure_loaded()
+        policy = queue_engine.lanes.policy
+        order = []
+        for row_id, position in sorted(queue_engine.positions().items(), key=lambda item: item[1]):
+            row = queue_engine.get(row_id)
+            if row is not None:
+                order.append({"id": str(row_id), "request_id": row["request_id"] or "",
+                              "lane": policy.lane(row), "position": position})
+        return json_response({"policy": policy.describe(), "order": order})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# The caller's request as seen by /api/queue/my_position
+MY_POSITION_ROW = RowSchema([
+    ("id", "str"), ("request_id", "str"), ("payment", "str"), ("status", "str"),
+    ("counter", "minutes_left", "call_deadline"), ("schedule", "datetime")
+])
+
+def active_window_count():
+    """Number of admin windows currently serving, from the cached TV window list"""
+    body, _ = tv_cache.get('active_admins:windows', lambda: encode_with_etag(load_tv_windows()))
+    return len(json.loads(body))
+
+@app.route('/api/queue/my_position', methods=['GET'])
+@token_required
+def get_my_position():
+    """The caller's place in their payment lane and when they can expect to be called"""
+    user_id = g.user.get('id')
+    user_idno = g.user.get('idno')
+    
+    if not user_id:
+        return jsonify({"error": "User ID not found in token"}), 400
+    
+    try:
+        queue_engine.ensure_loaded()
+        row = queue_engine.find_own(user_id, user_idno)
+        if not row:
+            return jsonify({"has_request": False})
+        
+        result = MY_POSITION_ROW.convert(row)
+        result["has_request"] = True
+        result["lane"] = row["payment"] or ""
+        now = datetime.now()
+        
+        place = queue_engine.lane_position(row["id"], now) if row["status"] == 'pending' else None
+        if place is None:
+            # Already on call, booked for later (not queued until then), or the
+            # lane order is unavailable: nothing left to estimate
+            later = row["status"] == 'pending' and not due_by(row, now)
+            result.update({"lane_position": None, "lane_size": None, "ahead": 0,
+                           "estimated_wait_minutes": 0 if row["status"] == 'oncall' else None,
+                           "estimated_call_time": row["schedule"].isoformat() if later else None})
+            return json_response(result)
+        
+        windows = active_window_count()
+        wait_seconds = service_times.estimate_wait(place["ahead"], windows, now)
+        call_time = now + timedelta(seconds=wait_seconds)
+        if row["schedule"] is not None and row["schedule"] > call_time:
+            # Not called before the booked time
+            call_time = row["schedule"]
+        
+        result.update({
+            "lane_position": place["position"],
+            "lane_size": place["size"],
+            "ahead": sum(place["ahead"].values()),
+            "windows": windows,
+            "service_time_seconds": round(service_times.service_time(row["payment"], now.hour)),
+            "estimated_wait_minutes": math.ceil((call_time - now).total_seconds() / 60),
+            "estimated_call_time": call_time.isoformat()
+        })
+        return json_response(result)
+    except Exception as e:
+        print(f"Error in get_my_position: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+# Payment lanes an admin can switch on and off in their filter settings
+QUEUE_LANES = ('express', 'regular', 'priority')
+# Queued requests call_next tries to claim before falling back to a plain query
+DISPATCH_CANDIDATES = 5
+
+# A request claimed by /api/queue/call_next, as the admin client shows it
+CALLED_REQUEST_ROW = RowSchema([
+    ("id", "str"), ("idno", "str"), ("name", "str"), ("email", "str"), ("level", "str"),
+    ("method", "str"), ("payment", "str"), ("status", "str"), ("counter", "minutes_left", "call_deadline"),
+    ("request_id", "str"), ("schedule", "datetime"), ("assigned_to", "int")
+])
+
+@app.route('/api/queue/call_next', methods=['POST'])
+@token_required
+def call_next_student():
+    """Claim the next pending request in the admin's lanes and put it on call"""
     if not g.user.get('is_admin'):
         return jsonify({"error": "Unauthorized"}), 401
     
+    admin_id = int(g.user.get('id'))
+    data = request.get_json(silent=True) or {}
+    try:
+        minutes = int(data.get('counter', 30))  # Default 30 minutes
+    except (TypeError, ValueError):
+        return jsonify({"error": "counter must be a whole number of minutes"}), 400
+    
     conn, cursor = None, None
     try:
         conn = get_db_connection()
         if not conn:
-             return jsonify({"error": "Database connection failed"}), 500
-        cursor = conn.cursor()
+            return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
         
-        # Reset the user's request-related fields
+        filter_settings = fetch_admin_settings(cursor, [admin_id])[admin_id].get('filter_settings') or DEFAULT_FILTER_SETTINGS
+        lanes = [lane for lane in QUEUE_LANES if filter_settings.get(lane, True)]
+        if not lanes:
+            return jsonify({"claimed": False, "message": "All lanes are switched off in your filter settings"})
+        
+        # Requests without a payment type show in every lane, as on the TV.
+        # Bookings aren't called before their time
+        now = datetime.now().replace(microsecond=0)
+        
+        def eligible(candidate):
+            return candidate['assigned_to'] in (None, admin_id) and due_by(candidate, now)
+        
+        # Try the next few in lane-scheduler order. SKIP LOCKED: a row another
+        # window is claiming right now is passed over instead of waited for,
+        # so concurrent calls get different students. The candidate is checked
+        # again against the database, as memory may be behind another worker
+        placeholders = ', '.join(['%s'] * len(lanes))
+        claimable = f"""
+            r.status = 'pending'
+            AND (r.payment IN ({placeholders}) OR r.payment IS NULL OR r.payment = '')
+            AND (r.assigned_to IS NULL OR r.assigned_to = %s)
+            AND (r.schedule IS NULL OR r.schedule <= %s)
+        """
+        claimable_params = tuple(lanes) + (admin_id, now)
+        queue_engine.ensure_loaded()
+        row = None
+        for candidate in queue_engine.dispatch_candidates(DISPATCH_CANDIDATES, lanes, eligible):
+            cursor.execute(f"""
+                SELECT {QUEUE_SELECT_LIST}, r.id AS request_pk
+                FROM requests r JOIN users u ON u.id = r.user_id
+                WHERE r.user_id = %s AND {claimable}
+                FOR UPDATE OF r SKIP LOCKED
+            """, (candidate['id'],) + claimable_params)
+            row = cursor.fetchone()
+            if row:
+                break
+        
+        if not row:
+            # Taken by other windows, or not in this worker's queue yet: fall back
+            # to the first eligible row in schedule order
+            cursor.execute(f"""
+                SELECT {QUEUE_SELECT_LIST}, r.id AS request_pk
+                FROM requests r JOIN users u ON u.id = r.user_id
+                WHERE {claimable}
+                ORDER BY r.schedule ASC, r.id ASC
+                LIMIT 1
+                FOR UPDATE OF r SKIP LOCKED
+            """, claimable_params)
+            row = cursor.fetchone()
+        if not row:
+            conn.rollback()
+            return jsonify({"claimed": False, "message": "No pending requests in your lanes"})
+        
+        call_deadline = now + timedelta(minutes=minutes)
         cursor.execute("""
-            UPDATE users 
-            SET status = NULL, schedule = NULL, method = NULL, 
-                payment = NULL, request_id = NULL 
+            UPDATE requests SET status = 'oncall', assigned_to = %s, counter = %s, call_deadline = %s
             WHERE id = %s
-        """, (user_id,))
-        
+        """, (admin_id, minutes, call_deadline, row.pop('request_pk')))
         conn.commit()
         
-        return jsonify({"success": True, "message": "Request deleted successfully"})
+        queue_engine.record_dispatch(row)
+        row.update(status='oncall', assigned_to=admin_id, counter=minutes, call_deadline=call_deadline)
+        queue_engine.apply(cursor, [row['id']], status='oncall', assigned_to=admin_id,
+                           counter=minutes, call_deadline=call_deadline)
+        call_timer.arm(row['id'], call_deadline)
+        tv_cache.invalidate('tv_pending_requests')
+        
+        return json_response({"claimed": True, "request": CALLED_REQUEST_ROW.convert(row)})
     except Exception as e:
+        print(f"Error in call_next_student: {str(e)}")
         return jsonify({"error": str(e)}), 500
     finally:
         if cursor:
@@ -1279,94 +1663,144 @@ def delete_scheduled_request(user_id):
         if conn and conn.is_connected():
             conn.close()
 
-# Background task to check and auto-reject users with expired counters
-def auto_reject_expired_users():
-    print("Starting auto-reject background thread...")
-    while True:
-        try:
-            # Find and reject expired users
-            conn = get_db_connection()
-            if conn:
-                cursor = conn.cursor(dictionary=True)
-                try:
-                    # Find users with status 'oncall' and counter <= 0
-                    # ONLY include users with non-null counter values to prevent rejecting users without timers
-                    cursor.execute("SELECT id FROM users WHERE status = 'oncall' AND counter IS NOT NULL AND counter <= 0")
-                    expired_users = cursor.fetchall()
-                    
-                    # Auto-reject each expired user
-                    for user in expired_users:
-                        user_id = user['id']
-                        print(f"Auto-rejecting user {user_id} due to expired counter")
-                        cursor.execute("UPDATE users SET status = 'rejected', counter = NULL WHERE id = %s", (user_id,))
-                    
-                    if expired_users:
-                        print(f"Auto-rejected {len(expired_users)} users with expired timers")
-                    
-                    conn.commit()
-                finally:
-                    cursor.close()
-                    conn.close()
-            
-            # Decrement counter in a separate connection
-            conn = get_db_connection()
-            if conn:
-                cursor = conn.cursor()
-                try:
-                    # Count how many rows will be affected for logging
-                    cursor.execute("SELECT COUNT(*) FROM users WHERE status = 'oncall' AND counter > 0")
-                    count = cursor.fetchone()[0]
-                    
-                    # Decrement counter for all oncall users
-                    cursor.execute("UPDATE users SET counter = counter - 1 WHERE status = 'oncall' AND counter > 0")
-                    conn.commit()
-                    
-                    if count > 0:
-                        print(f"Decremented counter for {count} oncall users")
-                except Exception as e:
-                    print(f"Error decrementing counters: {e}")
-                finally:
-                    cursor.close()
-                    conn.close()
-                
-        except Exception as e:
-            print(f"Error in auto-reject background task: {e}")
-        
-        # Sleep for 1 minute before checking again
-        time.sleep(60)
-
-# Start the background task in a separate thread
-auto_reject_thread = threading.Thread(target=auto_reject_expired_users, daemon=True)
-
-# Start the auto-reject thread when the server starts
-if __name__ == '__main__':
-    # Start the auto-reject background thread
-    auto_reject_thread.start()
-    print("Auto-reject background thread started")
-    
-    # Start the Flask application
-    app.run(host="0.0.0.0", port=5057, debug=False)
-else:
-    # When imported as a module, still start the thread
-    auto_reject_thread.start()
-    print("Auto-reject background thread started in module mode")
-
-@app.route('/api/user_by_id', methods=['GET'])
+@app.route('/api/delete_scheduled_request/<int:user_id>', methods=['DELETE'])
 @token_required
-def get_user_by_id():
-    """Get user information by ID number for admin request creation"""
+def delete_scheduled_request(user_id):
     if not g.user.get('is_admin'):
-        return jsonify({"error": "Admin privileges required"}), 403
-    
-    idno = request.args.get('idno')
-    if not idno:
-        return jsonify({"error": "ID number is required"}), 400
+        return jsonify({"error": "Unauthorized"}), 401
     
     conn, cursor = None, None
     try:
         conn = get_db_connection()
         if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
+             return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor()
+        
+        # Remove the user's open request and give its slot place back
+        cursor.execute("SELECT schedule FROM requests WHERE user_id = %s AND status IN ('pending', 'oncall') FOR UPDATE",
+                       (user_id,))
+        old_schedules = [row[0] for row in cursor.fetchall()]
+        cursor.execute("DELETE FROM requests WHERE user_id = %s AND status IN ('pending', 'oncall')", (user_id,))
+        for old_schedule in old_schedules:
+            release_slot(cursor, old_schedule)
+        
+        conn.commit()
+        queue_engine.apply(cursor, [user_id], status=None)
+        tv_cache.invalidate('tv_pending_requests')
+        tv_cache.invalidate('slots')
+        
+        return jsonify({"success": True, "message": "Request deleted successfully"})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+def reject_expired_calls():
+    """Reject every on-call request whose deadline has passed, in one UPDATE"""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    cursor = conn.cursor()
+    try:
+        now = datetime.now()
+        # Locked, so the UPDATE below rejects exactly these rows
+        cursor.execute("""
+            SELECT user_id, status, schedule FROM requests
+            WHERE status = 'oncall' AND call_deadline <= %s FOR UPDATE
+        """, (now,))
+        expired = cursor.fetchall()
+        if not expired:
+            conn.rollback()
+            return 0
+        expired_ids = [row[0] for row in expired]
+        
+        cursor.execute("""
+            UPDATE requests SET status = 'rejected', counter = NULL, call_deadline = NULL
+            WHERE status = 'oncall' AND call_deadline <= %s
+        """, (now,))
+        rejected = cursor.rowcount
+        slots_changed = move_slot_places(cursor, [row[1:] for row in expired], 'rejected')
+        conn.commit()
+        queue_engine.refresh(cursor, expired_ids)
+        tv_cache.invalidate('tv_pending_requests')
+        if slots_changed:
+            tv_cache.invalidate('slots')
+        
+        print(f"Auto-rejected {rejected} users with expired timers")
+        return rejected
+    finally:
+        cursor.close()
+        conn.close()
+
+def auto_reject_expired_users():
+    """Reject requests whose on-call deadline has passed; returns seconds until the next deadline"""
+    if call_timer.pop_due():
+        reject_expired_calls()
+    next_deadline = call_timer.next_deadline()
+    if next_deadline is not None:
+        return min(AUTO_REJECT_INTERVAL, (next_deadline - datetime.now()).total_seconds())
+
+def reconcile_queue_engine():
+    """Bring the in-memory queue in line with the database"""
+    drift = queue_engine.reconcile()
+    # Picks up calls made by other workers and re-arms any missed expiry
+    call_timer.reset(queue_engine.call_deadlines())
+    if drift:
+        print(f"Queue engine reconciled {drift} rows changed outside this process")
+        tv_cache.invalidate('tv_pending_requests')
+
+def refresh_countdowns():
+    """Let TV screens see the minutes left on on-call timers go down"""
+    if queue_engine.call_deadlines():
+        tv_cache.invalidate('tv_pending_requests')
+
+def refresh_service_times():
+    """Fold history entries logged since the last run into the service time means"""
+    conn, cursor = None, None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        cursor = conn.cursor(dictionary=True)
+        service_times.refresh(cursor)
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+job_scheduler.add('auto_reject', auto_reject_expired_users, interval=AUTO_REJECT_INTERVAL)
+# Every worker keeps its own queue engine and TV cache, so these run everywhere
+job_scheduler.add('queue_reconcile', reconcile_queue_engine, interval=QUEUE_RECONCILE_SECONDS,
+                  jitter=QUEUE_RECONCILE_SECONDS / 5, leader_only=False)
+job_scheduler.add('countdown_refresh', refresh_countdowns, interval=CALL_COUNTDOWN_REFRESH, leader_only=False)
+job_scheduler.add('service_times', refresh_service_times, interval=SERVICE_TIMES_REFRESH_SECONDS,
+                  jitter=SERVICE_TIMES_REFRESH_SECONDS / 10, leader_only=False)
+
+@app.before_first_request
+def start_background_jobs():
+    """Start this worker's job scheduler with its first request rather than at import"""
+    job_scheduler.start()
+
+@app.route('/api/user_by_id', methods=['GET'])
+@token_required
+def get_user_by_id():
+    """Get user information by ID number for admin request creation"""
+    if not g.user.get('is_admin'):
+        return jsonify({"error": "Admin privileges required"}), 403
+    
+    idno = request.args.get('idno')
+    if not idno:
+        return jsonify({"error": "ID number is required"}), 400
+    
+    conn, cursor = None, None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
         
         cursor = conn.cursor(dictionary=True)
         cursor.execute("SELECT id, idno, name, email, level, course, strand FROM users WHERE idno = %s", (idno,))
@@ -1375,18 +1809,7 @@ def get_user_by_id():
         if not user:
             return jsonify({"error": "User not found"}), 404
         
-        # Process the user data
-        processed_user = {
-            "id": str(user["id"]) if user["id"] is not None else "",
-            "idno": str(user["idno"]) if user["idno"] is not None else "",
-            "name": str(user["name"]) if user["name"] is not None else "",
-            "email": str(user["email"]) if user["email"] is not None else "",
-            "level": str(user["level"]) if user["level"] is not None else "",
-            "course": str(user["course"]) if user["course"] is not None else "",
-            "strand": str(user["strand"]) if user["strand"] is not None else ""
-        }
-        
-        return jsonify(processed_user)
+        return json_response(USER_ROW.convert(user))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -1414,7 +1837,7 @@ def admin_create_appointment():
     payment = data.get('payment')
     method = data.get('method')
     date = data.get('date')
-    time = data.get('time')
+    appointment_time = data.get('time')
     request_id = data.get('request_id')  # Get request_id if provided from client
     
     # Check if we should preserve course/strand
@@ -1423,7 +1846,7 @@ def admin_create_appointment():
     strand = data.get('strand', '')
     
     # Validate required fields
-    if not all([level, req_type, payment, method, date, time]):
+    if not all([level, req_type, payment, method, date, appointment_time]):
         return jsonify({"error": "Missing required fields"}), 400
     
     # Validate enum values
@@ -1439,6 +1862,11 @@ def admin_create_appointment():
     
     if method not in valid_methods:
         return jsonify({"error": f"Invalid method. Must be one of: {', '.join(valid_methods)}"}), 400
+    
+    try:
+        schedule = parse_schedule(f"{date} {appointment_time}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
         
     conn, cursor = None, None
     try:
@@ -1455,14 +1883,10 @@ def admin_create_appointment():
             return jsonify({"error": "Student not found with the provided ID number"}), 404
             
         student_id = student[0]
-        schedule_datetime = f"{date} {time}"
         
-        # Generate a request ID if not provided
+        # Generate a request ID if not provided: the next ticket in the payment lane for that day
         if not request_id:
-            # First letter of payment type + random 4-digit number
-            first_letter = payment[0].upper()
-            random_num = str(1000 + int(1000 * time.time() % 9000)).zfill(4)
-            request_id = f"{first_letter}-{random_num}"
+            request_id = ticket_allocator.allocate(payment, schedule.date())
         
         # If preserve_course_strand flag is set, use the provided course/strand values
         # If not provided but preserve flag is set, use the student's existing values
@@ -1479,11 +1903,15 @@ def admin_create_appointment():
             course_value = req_type
             strand_value = req_type
         
-        sql = "UPDATE users SET level=%s, course=%s, strand=%s, schedule=%s, method=%s, payment=%s, status='pending', request_id=%s WHERE id=%s"
-        params = (level, course_value, strand_value, schedule_datetime, method, payment, request_id, student_id)
-        
-        cursor.execute(sql, params)
+        cursor.execute("UPDATE users SET level=%s, course=%s, strand=%s WHERE id=%s",
+                       (level, course_value, strand_value, student_id))
+        if not book_request(cursor, student_id, level, schedule, method, payment, request_id):
+            conn.rollback()
+            return jsonify({"error": "That time slot is fully booked"}), 409
         conn.commit()
+        queue_engine.refresh(cursor, [student_id])
+        tv_cache.invalidate('tv_pending_requests')
+        tv_cache.invalidate('slots')
         
         return jsonify({
             "success": True, 
@@ -1514,23 +1942,7 @@ def get_priority_users():
         
         cursor = conn.cursor(dictionary=True)
         cursor.execute("SELECT id, idno, name, email, level, course, strand FROM users WHERE flags = 'priority_user'")
-        users = cursor.fetchall()
-        
-        # Convert to safe dictionaries
-        safe_users = []
-        for user in users:
-            safe_user = {
-                "id": str(user["id"]) if user["id"] is not None else "",
-                "idno": str(user["idno"]) if user["idno"] is not None else "",
-                "name": str(user["name"]) if user["name"] is not None else "",
-                "email": str(user["email"]) if user["email"] is not None else "",
-                "level": str(user["level"]) if user["level"] is not None else "",
-                "course": str(user["course"]) if user["course"] is not None else "",
-                "strand": str(user["strand"]) if user["strand"] is not None else ""
-            }
-            safe_users.append(safe_user)
-        
-        return jsonify(safe_users)
+        return json_response(USER_ROW.many(cursor.fetchall()))
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1669,16 +2081,6 @@ def check_new_user():
             return jsonify({"error": "Database connection failed"}), 500
         
         cursor = conn.cursor(dictionary=True)
-        
-        # Add new_user column if it doesn't exist
-        try:
-            cursor.execute("SHOW COLUMNS FROM users LIKE 'new_user'")
-            if not cursor.fetchone():
-                cursor.execute("ALTER TABLE users ADD COLUMN new_user ENUM('yes', 'no') DEFAULT 'yes'")
-                conn.commit()
-        except Exception as e:
-            print(f"Error checking/adding new_user column: {str(e)}")
-        
         cursor.execute("SELECT new_user FROM users WHERE id = %s", (user_id,))
         user = cursor.fetchone()
         
@@ -1721,15 +2123,6 @@ def update_new_user_status():
         
         cursor = conn.cursor()
         
-        # Add new_user column if it doesn't exist
-        try:
-            cursor.execute("SHOW COLUMNS FROM users LIKE 'new_user'")
-            if not cursor.fetchone():
-                cursor.execute("ALTER TABLE users ADD COLUMN new_user ENUM('yes', 'no') DEFAULT 'yes'")
-                conn.commit()
-        except Exception as e:
-            print(f"Error checking/adding new_user column: {str(e)}")
-        
         # Update the user's new_user status
         cursor.execute("UPDATE users SET new_user = %s WHERE id = %s", (new_status, user_id))
         conn.commit()
@@ -1770,39 +2163,6 @@ def save_admin_settings():
         
         cursor = conn.cursor()
         
-        # Check if status column exists in admins table, add if needed
-        cursor.execute("SHOW COLUMNS FROM admins LIKE 'status'")
-        if not cursor.fetchone():
-            try:
-                cursor.execute("ALTER TABLE admins ADD COLUMN status ENUM('online', 'offline') DEFAULT 'offline'")
-                conn.commit()
-                print("Added status column to admins table")
-            except mysql.connector.Error as e:
-                print(f"Error adding status column: {e}")
-        
-        # Check if last_active column exists in admins table, add if needed
-        cursor.execute("SHOW COLUMNS FROM admins LIKE 'last_active'")
-        if not cursor.fetchone():
-            try:
-                cursor.execute("ALTER TABLE admins ADD COLUMN last_active TIMESTAMP NULL DEFAULT NULL")
-                conn.commit()
-                print("Added last_active column to admins table")
-            except mysql.connector.Error as e:
-                print(f"Error adding last_active column: {e}")
-        
-        # Check if admin_settings table exists, create if not
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS admin_settings (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                admin_id INT NOT NULL,
-                settings TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                UNIQUE KEY unique_admin (admin_id)
-            )
-        """)
-        conn.commit()
-        
         # Check if settings already exist for this admin
         cursor.execute("SELECT id FROM admin_settings WHERE admin_id = %s", (admin_id,))
         existing = cursor.fetchone()
@@ -1829,6 +2189,9 @@ def save_admin_settings():
             WHERE id = %s
         """, (admin_id,))
         conn.commit()
+        with admin_settings_lock:
+            admin_settings_cache.pop(int(admin_id), None)
+        tv_cache.invalidate('tv_admin_settings', 'active_admins')
         
         return jsonify({"success": True, "message": "Settings saved successfully"})
     except Exception as e:
@@ -2147,19 +2510,10 @@ def admin_update_status():
             
             cursor = conn.cursor()
             
-            # First, make sure the is_active column exists
-            cursor.execute("SHOW COLUMNS FROM admins LIKE 'is_active'")
-            if not cursor.fetchone():
-                try:
-                    cursor.execute("ALTER TABLE admins ADD COLUMN is_active ENUM('yes', 'no') DEFAULT 'no'")
-                    conn.commit()
-                    print("Added is_active column to admins table")
-                except mysql.connector.Error as e:
-                    return jsonify({"error": f"Failed to add is_active column: {str(e)}"}), 500
-            
             # Update the admin's active status
             cursor.execute("UPDATE admins SET is_active = %s WHERE id = %s", (is_active, admin_id))
             conn.commit()
+            tv_cache.invalidate('active_admins')
             
             # Get the updated admin info
             cursor.execute("SELECT id, full_name, room_name, is_active FROM admins WHERE id = %s", (admin_id,))
@@ -2220,24 +2574,9 @@ def get_admin_settings():
         
         cursor = conn.cursor(dictionary=True)
         
-        # Get admin settings from database
-        cursor.execute("SELECT settings FROM admin_settings WHERE admin_id = %s", (admin_id,))
-        settings_row = cursor.fetchone()
-        
-        if settings_row and settings_row.get('settings'):
-            import json
-            settings = json.loads(settings_row['settings'])
-            return jsonify({"settings": settings})
-        else:
-            # Return default settings if none found
-            default_settings = {
-                "filter_settings": {
-                    "express": True,
-                    "regular": True,
-                    "priority": True
-                }
-            }
-            return jsonify({"settings": default_settings})
+        # Saved settings, or the defaults if none found
+        settings = fetch_admin_settings(cursor, [admin_id])[admin_id]
+        return jsonify({"settings": settings})
             
     except Exception as e:
         print(f"Error getting admin settings: {str(e)}")
@@ -2248,54 +2587,102 @@ def get_admin_settings():
         if conn and conn.is_connected():
             conn.close()
 
-# Add a new endpoint for TV display to get admin settings without authentication
-@app.route('/api/tv/get-admin-settings', methods=['GET', 'OPTIONS'])
-def get_tv_admin_settings():
-    """Get admin settings for TV display without authentication"""
-    # Handle OPTIONS request for CORS preflight
-    if request.method == 'OPTIONS':
-        response = app.make_default_options_response()
-        return response
-    
-    # Get admin ID from query parameter
-    admin_id = request.args.get('admin_id', '1')  # Default to admin with ID 1
-    
+# Lanes a TV window shows when its admin never saved filter settings
+DEFAULT_FILTER_SETTINGS = {
+    "express": True,
+    "regular": True,
+    "priority": True
+}
+
+# Most admins one batched settings request may ask for
+MAX_SETTINGS_BATCH = 50
+
+# Parsed admin_settings blobs: admin_id -> (updated_at, settings). The cached
+# dicts are shared between requests, so callers must not modify them.
+admin_settings_cache = {}
+admin_settings_lock = threading.Lock()
+
+def parse_admin_settings(admin_id, updated_at, settings_text):
+    """Parse an admin's settings blob, reusing the last parse while updated_at is unchanged"""
+    with admin_settings_lock:
+        cached = admin_settings_cache.get(admin_id)
+    if cached and updated_at is not None and cached[0] == updated_at:
+        return cached[1]
+    settings = json.loads(settings_text)
+    with admin_settings_lock:
+        admin_settings_cache[admin_id] = (updated_at, settings)
+    return settings
+
+def fetch_admin_settings(cursor, admin_ids):
+    """{admin_id: settings} for several admins from one query; defaults for admins with none saved"""
+    admin_ids = [int(admin_id) for admin_id in admin_ids]
+    result = {admin_id: {"filter_settings": dict(DEFAULT_FILTER_SETTINGS)} for admin_id in admin_ids}
+    if not admin_ids:
+        return result
+    
+    placeholders = ', '.join(['%s'] * len(result))
+    cursor.execute(f"SELECT admin_id, settings, updated_at FROM admin_settings WHERE admin_id IN ({placeholders})",
+                   tuple(result))
+    for row in cursor.fetchall():
+        if row["settings"]:
+            result[row["admin_id"]] = parse_admin_settings(row["admin_id"], row["updated_at"], row["settings"])
+    return result
+
+def parse_admin_ids(value):
+    """"3,1,3" -> [1, 3]; ValueError when an id isn't a number or there are too many"""
+    admin_ids = sorted({int(part) for part in value.split(',') if part.strip()})
+    if not admin_ids or len(admin_ids) > MAX_SETTINGS_BATCH:
+        raise ValueError(f"admin_ids must list between 1 and {MAX_SETTINGS_BATCH} admin ids")
+    return admin_ids
+
+def load_tv_admin_settings(admin_ids):
+    """{admin_id: settings} for the TV display"""
     conn, cursor = None, None
     try:
         conn = get_db_connection()
         if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
+            raise RuntimeError("Database connection failed")
         
         cursor = conn.cursor(dictionary=True)
-        
-        # Get admin settings from database
-        cursor.execute("SELECT settings FROM admin_settings WHERE admin_id = %s", (admin_id,))
-        settings_row = cursor.fetchone()
-        
-        if settings_row and settings_row.get('settings'):
-            import json
-            settings = json.loads(settings_row['settings'])
-            return jsonify({"settings": settings})
-        else:
-            # Return default settings if none found
-            default_settings = {
-                "filter_settings": {
-                    "express": True,
-                    "regular": True,
-                    "priority": True
-                }
-            }
-            return jsonify({"settings": default_settings})
-            
-    except Exception as e:
-        print(f"Error getting admin settings for TV: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return fetch_admin_settings(cursor, admin_ids)
     finally:
         if cursor:
             cursor.close()
         if conn and conn.is_connected():
             conn.close()
 
+# Add a new endpoint for TV display to get admin settings without authentication
+@app.route('/api/tv/get-admin-settings', methods=['GET', 'OPTIONS'])
+def get_tv_admin_settings():
+    """Get admin settings for TV display without authentication"""
+    # ?admin_id=1 answers {"settings": {...}}; ?admin_ids=1,2,3 answers
+    # {"settings": {"1": {...}, "2": {...}, "3": {...}}} from a single query
+    # Handle OPTIONS request for CORS preflight
+    if request.method == 'OPTIONS':
+        response = app.make_default_options_response()
+        return response
+    
+    try:
+        if request.args.get('admin_ids'):
+            admin_ids = parse_admin_ids(request.args['admin_ids'])
+            batched = True
+        else:
+            # Get admin ID from query parameter
+            admin_ids = [int(request.args.get('admin_id', '1'))]  # Default to admin with ID 1
+            batched = False
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    key = f"tv_admin_settings:{'batch:' if batched else ''}{','.join(str(admin_id) for admin_id in admin_ids)}"
+    
+    def load():
+        settings = load_tv_admin_settings(admin_ids)
+        if batched:
+            return {"settings": {str(admin_id): value for admin_id, value in settings.items()}}
+        return {"settings": settings[admin_ids[0]]}
+    
+    return cached_json_response(key, load)
+
 @app.route('/tv_display')
 def tv_display_page():
     """Serve the TV display page"""
@@ -2317,16 +2704,6 @@ def set_admin_active():
             
             cursor = conn.cursor()
             
-            # First, make sure the is_active column exists
-            cursor.execute("SHOW COLUMNS FROM admins LIKE 'is_active'")
-            if not cursor.fetchone():
-                try:
-                    cursor.execute("ALTER TABLE admins ADD COLUMN is_active ENUM('yes', 'no') DEFAULT 'no'")
-                    conn.commit()
-                    print("Added is_active column to admins table")
-                except mysql.connector.Error as e:
-                    return jsonify({"error": f"Failed to add is_active column: {str(e)}"}), 500
-            
             # Special case: if is_active is 'check', just return the current status without changing it
             if is_active == 'check':
                 cursor.execute("SELECT id, full_name, room_name, is_active FROM admins WHERE id = %s", (admin_id,))
@@ -2354,16 +2731,6 @@ def set_admin_active():
             
             # Update room_name as well if specified
             if room_name:
-                # First check if room_name column exists
-                cursor.execute("SHOW COLUMNS FROM admins LIKE 'room_name'")
-                if not cursor.fetchone():
-                    try:
-                        cursor.execute("ALTER TABLE admins ADD COLUMN room_name VARCHAR(255)")
-                        conn.commit()
-                        print("Added room_name column to admins table")
-                    except mysql.connector.Error as e:
-                        return jsonify({"error": f"Failed to add room_name column: {str(e)}"}), 500
-                        
                 # Update both room_name and is_active
                 cursor.execute("UPDATE admins SET room_name = %s, is_active = %s WHERE id = %s", 
                               (room_name, is_active, admin_id))
@@ -2372,6 +2739,7 @@ def set_admin_active():
                 cursor.execute("UPDATE admins SET is_active = %s WHERE id = %s", (is_active, admin_id))
             
             conn.commit()
+            tv_cache.invalidate('active_admins')
             
             # Verify the update by fetching the current admin data
             cursor.execute("SELECT id, full_name, room_name, is_active FROM admins WHERE id = %s", (admin_id,))
@@ -2425,6 +2793,12 @@ def create_test_request():
         status = data.get('status')
         request_id = data.get('request_id')
         assigned_to = data.get('assigned_to')
+        schedule = data.get('schedule')
+        
+        try:
+            schedule = parse_schedule(schedule) if schedule else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         conn, cursor = None, None
         try:
@@ -2434,28 +2808,30 @@ def create_test_request():
             
             cursor = conn.cursor()
             
-            # Check if assigned_to column exists
-            cursor.execute("SHOW COLUMNS FROM users LIKE 'assigned_to'")
-            if not cursor.fetchone():
-                try:
-                    cursor.execute("ALTER TABLE users ADD COLUMN assigned_to INT DEFAULT NULL")
-                    conn.commit()
-                    print("Added assigned_to column to users table")
-                except mysql.connector.Error as e:
-                    return jsonify({"error": f"Failed to add assigned_to column: {str(e)}"}), 500
-            
-            # Insert the test request into the database
+            # Insert a test student and their request into the database
+            cursor.execute(
+                "INSERT INTO users (idno, name, email, level) VALUES (%s, %s, %s, %s)",
+                (idno, name, email, level)
+            )
+            new_id = cursor.lastrowid
             cursor.execute("""
-                INSERT INTO users (idno, name, email, level, method, payment, status, request_id, assigned_to)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (idno, name, email, level, method, payment, status, request_id, assigned_to))
-            
+                INSERT INTO requests (user_id, level, method, payment, status, request_id, assigned_to, schedule)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """, (new_id, level, method, payment, status, request_id, assigned_to, schedule))
+            # Like any request with a status, it holds a place in its slot
+            holds_slot = status in OPEN_STATUSES and schedule is not None
+            if holds_slot:
+                reserve_slot(cursor, schedule, enforce=False)
             conn.commit()
+            queue_engine.refresh(cursor, [new_id])
+            tv_cache.invalidate('tv_pending_requests')
+            if holds_slot:
+                tv_cache.invalidate('slots')
             
             return jsonify({
                 "success": True,
                 "message": "Test request created successfully",
-                "id": cursor.lastrowid,
+                "id": new_id,
                 "request_id": request_id,
                 "name": name,
                 "idno": idno,
@@ -2478,84 +2854,35 @@ def create_test_request():
         print(f"Error processing test request: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# Queue rows for the TV display, including the counter each student is assigned to
+TV_REQUEST_ROW = RowSchema([
+    ("id", "str"), ("idno", "str"), ("name", "str"), ("level", "str"), ("method", "str"),
+    ("payment", "str"), ("status", "str"), ("counter", "minutes_left", "call_deadline"), ("request_id", "str"),
+    ("assigned_to", "int"), ("schedule", "datetime")
+])
+
+def load_tv_pending_requests():
+    """Pending and on-call queue rows for the TV display"""
+    queue_engine.ensure_loaded()
+    requests_processed = with_positions(TV_REQUEST_ROW.many(queue_engine.active()))
+    queue_log.observe(requests_processed)
+    return requests_processed
+
 @app.route('/api/tv_pending_requests', methods=['GET'])
 def get_tv_pending_requests():
     """Public endpoint for TV display to get pending requests without authentication"""
-    conn, cursor = None, None
-    try:
-        conn = get_db_connection()
-        if not conn:
-             return jsonify({"error": "Database connection failed"}), 500
-        cursor = conn.cursor(dictionary=True)
-        
-        # Check if assigned_to column exists
-        cursor.execute("SHOW COLUMNS FROM users LIKE 'assigned_to'")
-        if not cursor.fetchone():
-            try:
-                cursor.execute("ALTER TABLE users ADD COLUMN assigned_to INT DEFAULT NULL")
-                conn.commit()
-                print("Added assigned_to column to users table")
-            except mysql.connector.Error as e:
-                print(f"Error adding assigned_to column: {e}")
-        
-        # Include assigned_to in the query
-        cursor.execute("SELECT id, idno, name, level, method, payment, schedule, status, counter, request_id, assigned_to FROM users WHERE status IN ('pending', 'oncall') ORDER BY schedule ASC")
-        users_raw = cursor.fetchall()
-        
-        # Manually build a new list of dictionaries to ensure data is clean for JSON
-        users_processed = []
-        for user_row in users_raw:
-            processed_user = {
-                "id": str(user_row["id"]) if user_row["id"] is not None else "",
-                "idno": str(user_row["idno"]) if user_row["idno"] is not None else "",
-                "name": str(user_row["name"]) if user_row["name"] is not None else "",
-                "level": str(user_row["level"]) if user_row["level"] is not None else "",
-                "method": str(user_row["method"]) if user_row["method"] is not None else "",
-                "payment": str(user_row["payment"]) if user_row["payment"] is not None else "",
-                "status": str(user_row["status"]) if user_row["status"] is not None else "",
-                "counter": int(user_row["counter"]) if user_row["counter"] is not None else None,
-                "request_id": str(user_row["request_id"]) if user_row["request_id"] is not None else "",
-                "assigned_to": int(user_row["assigned_to"]) if user_row["assigned_to"] is not None else None,
-                "schedule": None  # Default to None
-            }
-            
-            # Handle datetime conversion safely
-            schedule = user_row["schedule"]
-            if schedule:
-                if isinstance(schedule, datetime):
-                    processed_user['schedule'] = schedule.isoformat()
-                else:
-                    # Try to convert to string if it's not a datetime object
-                    processed_user['schedule'] = str(schedule)
-                    
-            users_processed.append(processed_user)
-            
-        return jsonify(users_processed)
-    except Exception as e:
-        print(f"Error in tv_pending_requests: {str(e)}")  # Log the error for debugging
-        return jsonify({"error": str(e)}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if conn and conn.is_connected():
-            conn.close()
+    return cached_json_response('tv_pending_requests', load_tv_pending_requests)
 
-@app.route('/api/admin/active-status-check', methods=['GET'])
-def check_admin_active_status():
-    """Endpoint to check if any admin is active"""
+def load_active_admins():
+    """Admins currently serving at a counter"""
     conn, cursor = None, None
     try:
         conn = get_db_connection()
         if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
+            raise RuntimeError("Database connection failed")
         
         cursor = conn.cursor()
         
-        # Check if is_active column exists
-        cursor.execute("SHOW COLUMNS FROM admins LIKE 'is_active'")
-        if not cursor.fetchone():
-            return jsonify({"active_admins": []})
-        
         # Get all active admins - make sure to check is_active = 'yes'
         cursor.execute("SELECT id, full_name, room_name, is_active FROM admins WHERE is_active = 'yes'")
         active_admins = []
@@ -2571,17 +2898,29 @@ def check_admin_active_status():
         # Log the number of active admins found
         print(f"Found {len(active_admins)} active admins")
         
-        return jsonify({"active_admins": active_admins})
-        
-    except Exception as e:
-        print(f"Error checking admin active status: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return {"active_admins": active_admins}
     finally:
         if cursor:
             cursor.close()
         if conn and conn.is_connected():
             conn.close()
 
+@app.route('/api/queue/changes', methods=['GET'])
+def get_queue_changes():
+    """Queue changes since ?since=<version>, or the whole queue when they can't be replayed"""
+    try:
+        # Going through the cache reloads (and so diffs) the queue whenever the entry is stale
+        tv_cache.get('tv_pending_requests', lambda: encode_with_etag(load_tv_pending_requests()))
+    except Exception as e:
+        print(f"Error in queue changes: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    return json_response(queue_log.read(request.args.get('since')))
+
+@app.route('/api/admin/active-status-check', methods=['GET'])
+def check_admin_active_status():
+    """Endpoint to check if any admin is active"""
+    return cached_json_response('active_admins', load_active_admins)
+
 # Announcements data file path
 ANNOUNCEMENTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'announcements.json')
 
@@ -2636,6 +2975,14 @@ def get_announcements():
             if len(parts) == 2 and parts[0].lower() == 'bearer':
                 token = parts[1]
         
+        # Without a token the response is just the file, so its stat is enough to
+        # answer a poll that already has the current version
+        etag = None
+        if not token:
+            etag = file_etag(ANNOUNCEMENTS_FILE)
+            if not_modified(etag):
+                return conditional_json_response(b'', etag)
+        
         # Prepare response data
         response_data = {}
         
@@ -2673,7 +3020,7 @@ def get_announcements():
             except Exception as e:
                 print(f"Error getting admin settings: {str(e)}")
         
-        return jsonify(response_data), 200
+        return conditional_json_response(dumps(response_data), etag)
     except Exception as e:
         print(f"Error getting announcements: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -2715,6 +3062,10 @@ def get_threads():
     try:
         import json
         
+        etag = file_etag(THREADS_FILE)
+        if not_modified(etag):
+            return conditional_json_response(b'', etag)
+        
         # Prepare response data
         response_data = {"threads": []}
         
@@ -2724,11 +3075,24 @@ def get_threads():
                 thread_data = json.load(f)
                 response_data.update(thread_data)
         
-        return jsonify(response_data), 200
+        return conditional_json_response(dumps(response_data), etag)
     except Exception as e:
         print(f"Error getting threads: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# A student's own active request
+OWN_REQUEST_ROW = RowSchema([
+    ("id", "str"), ("idno", "str"), ("name", "str"), ("level", "str"), ("payment", "str"),
+    ("method", "str"), ("status", "str"), ("counter", "minutes_left", "call_deadline"), ("request_id", "str"),
+    ("schedule", "datetime")
+])
+
+# Other students' requests as shown in the notification panel
+NOTIFICATION_REQUEST_ROW = RowSchema([
+    ("id", "str"), ("idno", "str"), ("name", "str"), ("level", "str"), ("status", "str"),
+    ("counter", "minutes_left", "call_deadline"), ("request_id", "str"), ("schedule", "datetime")
+])
+
 @app.route('/api/user/check_own_request', methods=['GET'])
 @token_required
 def check_own_request():
@@ -2739,60 +3103,44 @@ def check_own_request():
     if not user_id:
         return jsonify({"error": "User ID not found in token"}), 400
     
-    conn, cursor = None, None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-        
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT id, idno, name, level, payment, method, schedule, status, counter, request_id
-            FROM users 
-            WHERE (id = %s OR idno = %s) AND status IN ('pending', 'oncall')
-            LIMIT 1
-        """, (user_id, user_idno))
-        
-        request_raw = cursor.fetchone()
+        queue_engine.ensure_loaded()
+        request_raw = queue_engine.find_own(user_id, user_idno)
         
         if not request_raw:
             # No pending request found
             return jsonify({"has_request": False})
         
-        # Process the result
-        processed_req = {
-            "has_request": True,
-            "id": str(request_raw["id"]) if request_raw["id"] is not None else "",
-            "idno": str(request_raw["idno"]) if request_raw["idno"] is not None else "",
-            "name": str(request_raw["name"]) if request_raw["name"] is not None else "",
-            "level": str(request_raw["level"]) if request_raw["level"] is not None else "",
-            "payment": str(request_raw["payment"]) if request_raw["payment"] is not None else "",
-            "method": str(request_raw["method"]) if request_raw["method"] is not None else "",
-            "status": str(request_raw["status"]) if request_raw["status"] is not None else "",
-            "counter": int(request_raw["counter"]) if request_raw["counter"] is not None else None,
-            "request_id": str(request_raw["request_id"]) if request_raw["request_id"] is not None else "",
-            "schedule": None
-        }
+        processed_req = with_positions([OWN_REQUEST_ROW.convert(request_raw)])[0]
+        processed_req["has_request"] = True
         
-        # Handle datetime conversion safely
-        schedule = request_raw["schedule"]
-        if schedule:
-            if isinstance(schedule, datetime):
-                processed_req['schedule'] = schedule.isoformat()
-            else:
-                processed_req['schedule'] = str(schedule)
-        
-        return jsonify(processed_req)
+        return json_response(processed_req)
     
     except Exception as e:
         print(f"Error in check_own_request: {str(e)}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if conn and conn.is_connected():
-            conn.close()
+
+# Requests listed in every student's notification panel
+NOTIFICATION_PANEL_SIZE = 50
+
+def notification_panel():
+    """[(id, idno, row, encoded row)] for the notification panel, encoded once per queue change
+
+    Rows are encoded with "is_current_user": false; the caller's own rows are
+    re-encoded per request.
+    """
+    queue_engine.ensure_loaded()
+    version, dispatches, minute = queue_engine.order_key()
+    key = f"notifications:{version}:{dispatches}:{minute:%Y%m%d%H%M}"
+    
+    def load():
+        panel = []
+        for req in with_positions(NOTIFICATION_REQUEST_ROW.many(queue_engine.active()[:NOTIFICATION_PANEL_SIZE])):
+            req["is_current_user"] = False
+            panel.append((req["id"], req["idno"], req, dumps(req)))
+        return panel
+    
+    return tv_cache.get(key, load)
 
 @app.route('/api/user/notifications', methods=['GET'])
 @token_required
@@ -2804,103 +3152,148 @@ def get_user_notifications():
     if not user_id:
         return jsonify({"error": "User ID not found in token"}), 400
     
-    conn, cursor = None, None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-        
-        cursor = conn.cursor(dictionary=True)
-        
-        # First check if the user has their own request
-        cursor.execute("""
-            SELECT id, idno, name, level, payment, method, schedule, status, counter, request_id
-            FROM users 
-            WHERE (id = %s OR idno = %s) AND status IN ('pending', 'oncall')
-            LIMIT 1
-        """, (user_id, user_idno))
-        
-        own_request_raw = cursor.fetchone()
-        
-        # Then get all pending and on-call requests (for notification panel)
-        cursor.execute("""
-            SELECT id, idno, name, level, schedule, status, counter, request_id
-            FROM users 
-            WHERE status IN ('pending', 'oncall')
-            ORDER BY schedule ASC
-            LIMIT 50
-        """)
-        
-        all_requests_raw = cursor.fetchall()
-        
-        # Process the results
-        result = {
-            "has_own_request": False,
-            "own_request": None,
-            "all_requests": []
-        }
-        
-        # Process own request if exists
-        if own_request_raw:
-            result["has_own_request"] = True
-            result["own_request"] = {
-                "id": str(own_request_raw["id"]) if own_request_raw["id"] is not None else "",
-                "idno": str(own_request_raw["idno"]) if own_request_raw["idno"] is not None else "",
-                "name": str(own_request_raw["name"]) if own_request_raw["name"] is not None else "",
-                "level": str(own_request_raw["level"]) if own_request_raw["level"] is not None else "",
-                "payment": str(own_request_raw["payment"]) if own_request_raw["payment"] is not None else "",
-                "method": str(own_request_raw["method"]) if own_request_raw["method"] is not None else "",
-                "status": str(own_request_raw["status"]) if own_request_raw["status"] is not None else "",
-                "counter": int(own_request_raw["counter"]) if own_request_raw["counter"] is not None else None,
-                "request_id": str(own_request_raw["request_id"]) if own_request_raw["request_id"] is not None else "",
-                "schedule": None
-            }
-            
-            # Handle datetime conversion safely for own request
-            schedule = own_request_raw["schedule"]
-            if schedule:
-                if isinstance(schedule, datetime):
-                    result["own_request"]["schedule"] = schedule.isoformat()
-                else:
-                    result["own_request"]["schedule"] = str(schedule)
-        
-        # Process all requests
-        for req in all_requests_raw:
-            processed_req = {
-                "id": str(req["id"]) if req["id"] is not None else "",
-                "idno": str(req["idno"]) if req["idno"] is not None else "",
-                "name": str(req["name"]) if req["name"] is not None else "",
-                "level": str(req["level"]) if req["level"] is not None else "",
-                "status": str(req["status"]) if req["status"] is not None else "",
-                "counter": int(req["counter"]) if req["counter"] is not None else None,
-                "request_id": str(req["request_id"]) if req["request_id"] is not None else "",
-                "schedule": None,
-                "is_current_user": (str(req["id"]) == user_id) or (str(req["idno"]) == user_idno)
-            }
-            
-            # Handle datetime conversion safely
-            schedule = req["schedule"]
-            if schedule:
-                if isinstance(schedule, datetime):
-                    processed_req["schedule"] = schedule.isoformat()
-                else:
-                    processed_req["schedule"] = str(schedule)
-            
-            result["all_requests"].append(processed_req)
-        
-        return jsonify(result)
+        # The shared panel (all pending and on-call requests), then the user's own request by key
+        panel = notification_panel()
+        own_request_raw = queue_engine.find_own(user_id, user_idno)
+        own_request = with_positions([OWN_REQUEST_ROW.convert(own_request_raw)])[0] if own_request_raw else None
+        
+        rows = []
+        for request_id, idno, req, encoded in panel:
+            if request_id == str(user_id) or idno == user_idno:
+                encoded = dumps(dict(req, is_current_user=True))
+            rows.append(encoded)
+        
+        # Same bytes dumps() would give for the whole dict (keys in sorted order)
+        body = b''.join([
+            b'{"all_requests":[', b','.join(rows), b']',
+            b',"has_own_request":', b'true' if own_request else b'false',
+            b',"own_request":', dumps(own_request),
+            b'}'
+        ])
+        return conditional_json_response(body)
     
     except Exception as e:
         print(f"Error in get_user_notifications: {str(e)}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if conn and conn.is_connected():
-            conn.close()
 
 # New endpoints for transaction history
 
+_UTC_OFFSET_RE = re.compile(r'^(?:UTC|GMT)?([+-])(\d{1,2})(?::?(\d{2}))?$', re.I)
+
+def parse_timezone(value):
+    """Resolve an IANA zone name or a +HH:MM offset to a tzinfo (None for empty)"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.upper() in ('UTC', 'GMT', 'Z'):
+        return timezone.utc
+    match = _UTC_OFFSET_RE.match(value)
+    if match:
+        sign = -1 if match.group(1) == '-' else 1
+        offset = timedelta(hours=int(match.group(2)), minutes=int(match.group(3) or 0))
+        return timezone(sign * offset)
+    if ZoneInfo is not None:
+        try:
+            return ZoneInfo(value)
+        except Exception:
+            pass
+    raise ValueError(f"Unknown time zone: {value}")
+
+def history_date_bounds(args):
+    """Turn start_date/end_date (inclusive days) into a half-open [start, end) timestamp range
+    
+    Days are taken in the ?tz= zone (or HISTORY_TIMEZONE) and converted to the
+    database session zone, so the bounds can be compared to action_date directly
+    and MySQL can range-scan its index.
+    """
+    local_tz = parse_timezone(args.get('tz') or HISTORY_TIMEZONE)
+    db_tz = parse_timezone(DB_TIMEZONE) if local_tz is not None else None
+    
+    def day_start(value, days_after=0):
+        try:
+            day = datetime.strptime(value, '%Y-%m-%d') + timedelta(days=days_after)
+        except ValueError:
+            raise ValueError("Invalid date format. Use YYYY-MM-DD")
+        if local_tz is None:
+            return day
+        return day.replace(tzinfo=local_tz).astimezone(db_tz).replace(tzinfo=None)
+    
+    start_date = args.get('start_date')
+    end_date = args.get('end_date')
+    start = day_start(start_date) if start_date else None
+    end = day_start(end_date, days_after=1) if end_date else None
+    return start, end
+
+# Query parameters that make up a history filter (carried inside page cursors)
+HISTORY_FILTER_ARGS = ('start_date', 'end_date', 'tz', 'status', 'idno', 'payment_type', 'admin_id')
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 1000))
+HISTORY_MAX_PAGE_SIZE = 5000
+
+def encode_history_cursor(row, filters):
+    """Opaque cursor for the page after `row`, remembering the filters it was listed with"""
+    payload = {"k": [row["action_date"].isoformat(), row["id"]], "f": filters}
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_history_cursor(value):
+    """Return (action_date, id, filters) from a cursor made by encode_history_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        payload = json.loads(raw)
+        action_date, row_id = payload["k"]
+        return datetime.fromisoformat(action_date), int(row_id), dict(payload.get("f") or {})
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def build_history_filter(args):
+    """SQL conditions (prefixed with AND) and params for the transaction history filters"""
+    conditions = ""
+    params = []
+    
+    start, end = history_date_bounds(args)
+    if start:
+        conditions += " AND action_date >= %s"
+        params.append(start)
+    if end:
+        conditions += " AND action_date < %s"
+        params.append(end)
+    
+    for arg_name, column in (('status', 'status'), ('idno', 'idno'),
+                             ('payment_type', 'payment'), ('admin_id', 'processed_by')):
+        value = args.get(arg_name)
+        if value:
+            conditions += f" AND {column} = %s"
+            params.append(value)
+    
+    return conditions, params
+
+def build_rollup_filter(args):
+    """Conditions on the daily rollup for the stats filters, or None when only raw rows can answer"""
+    # The rollup is keyed by day in the database time zone and doesn't keep idno
+    if args.get('idno') or args.get('tz') or HISTORY_TIMEZONE:
+        return None
+    
+    conditions = ""
+    params = []
+    for arg_name, operator in (('start_date', '>='), ('end_date', '<=')):
+        value = args.get(arg_name)
+        if value:
+            try:
+                day = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError("Invalid date format. Use YYYY-MM-DD")
+            conditions += f" AND stat_date {operator} %s"
+            params.append(day)
+    
+    for arg_name, column in (('status', 'status'), ('payment_type', 'payment'), ('admin_id', 'processed_by')):
+        value = args.get(arg_name)
+        if value:
+            conditions += f" AND {column} = %s"
+            params.append(value)
+    
+    return conditions, params
+
 @app.route('/api/create_transaction_history_table', methods=['GET'])
 @token_required
 def create_transaction_history_table():
@@ -2908,41 +3301,20 @@ def create_transaction_history_table():
     if not g.user.get('is_admin'):
         return jsonify({"error": "Admin privileges required"}), 403
     
-    conn, cursor = None, None
+    conn = None
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({"error": "Database connection failed"}), 500
         
-        cursor = conn.cursor()
-        
-        # Create transaction_history table if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transaction_history (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                request_id VARCHAR(20),
-                idno VARCHAR(20),
-                name VARCHAR(100),
-                level VARCHAR(20),
-                method VARCHAR(20),
-                payment VARCHAR(20),
-                status VARCHAR(20),
-                processed_by INT,
-                admin_name VARCHAR(100),
-                action_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                notes TEXT
-            )
-        """)
-        
-        conn.commit()
+        # The table is owned by the schema migrations; make sure they have been applied
+        run_migrations(conn)
         
         return jsonify({"success": True, "message": "Transaction history table created successfully"})
     except Exception as e:
         print(f"Error creating transaction history table: {str(e)}")
         return jsonify({"error": str(e)}), 500
     finally:
-        if cursor:
-            cursor.close()
         if conn and conn.is_connected():
             conn.close()
 
@@ -2969,11 +3341,12 @@ def log_transaction():
         
         cursor = conn.cursor(dictionary=True)
         
-        # First, get the user details to log
+        # First, get the user and their latest request to log
         cursor.execute("""
-            SELECT idno, name, level, method, payment, request_id
-            FROM users 
-            WHERE id = %s
+            SELECT u.idno, u.name, COALESCE(r.level, u.level) AS level, r.method, r.payment, r.request_id
+            FROM users u
+            LEFT JOIN requests r ON r.id = (SELECT MAX(id) FROM requests WHERE user_id = u.id)
+            WHERE u.id = %s
         """, (user_id,))
         
         user = cursor.fetchone()
@@ -3001,6 +3374,9 @@ def log_transaction():
             notes
         ))
         
+        # Count it in the daily rollup within the same transaction
+        cursor.execute(COUNT_HISTORY_ROW, (cursor.lastrowid,))
+        
         conn.commit()
         
         return jsonify({"success": True, "message": "Transaction logged successfully"})
@@ -3013,6 +3389,13 @@ def log_transaction():
         if conn and conn.is_connected():
             conn.close()
 
+# Transaction history entries as listed in the admin panel
+HISTORY_ROW = RowSchema([
+    ("id", "str"), ("request_id", "str"), ("idno", "str"), ("name", "str"), ("level", "str"),
+    ("method", "str"), ("payment", "str"), ("status", "str"), ("processed_by", "str"),
+    ("admin_name", "str"), ("notes", "str"), ("action_date", "datetime")
+])
+
 @app.route('/api/transaction_history', methods=['GET'])
 @token_required
 def get_transaction_history():
@@ -3020,13 +3403,28 @@ def get_transaction_history():
     if not g.user.get('is_admin'):
         return jsonify({"error": "Admin privileges required"}), 403
     
-    # Get filter parameters from query string
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    status = request.args.get('status')
-    idno = request.args.get('idno')
-    payment_type = request.args.get('payment_type')
-    admin_id = request.args.get('admin_id')
+    try:
+        page_size = int(request.args.get('page_size', HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "page_size must be a number"}), 400
+    page_size = min(max(page_size, 1), HISTORY_MAX_PAGE_SIZE)
+    
+    # Build the filter from the query string, or from the cursor when continuing a listing
+    try:
+        if request.args.get('cursor'):
+            after_date, after_id, filters = decode_history_cursor(request.args['cursor'])
+        else:
+            after_date, after_id = None, None
+            filters = {name: request.args[name] for name in HISTORY_FILTER_ARGS if request.args.get(name)}
+        conditions, params = build_history_filter(filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Keyset pagination: continue strictly after the last (action_date, id) already sent,
+    # so every page is an index range scan no matter how deep it is
+    if after_date is not None:
+        conditions += " AND (action_date < %s OR (action_date = %s AND id < %s))"
+        params += [after_date, after_date, after_id]
     
     conn, cursor = None, None
     try:
@@ -3036,69 +3434,22 @@ def get_transaction_history():
         
         cursor = conn.cursor(dictionary=True)
         
-        # Build query based on filters
-        query = "SELECT * FROM transaction_history WHERE 1=1"
-        params = []
-        
-        if start_date:
-            query += " AND DATE(action_date) >= %s"
-            params.append(start_date)
+        query = "SELECT * FROM transaction_history WHERE 1=1" + conditions
         
-        if end_date:
-            query += " AND DATE(action_date) <= %s"
-            params.append(end_date)
-        
-        if status:
-            query += " AND status = %s"
-            params.append(status)
-        
-        if idno:
-            query += " AND idno = %s"
-            params.append(idno)
-        
-        if payment_type:
-            query += " AND payment = %s"
-            params.append(payment_type)
-        
-        if admin_id:
-            query += " AND processed_by = %s"
-            params.append(admin_id)
-        
-        # Add sorting
-        query += " ORDER BY action_date DESC LIMIT 1000"
+        # Add sorting; one extra row tells us whether another page exists
+        query += " ORDER BY action_date DESC, id DESC LIMIT %s"
+        params.append(page_size + 1)
         
         cursor.execute(query, tuple(params))
         transactions_raw = cursor.fetchall()
+        has_more = len(transactions_raw) > page_size
+        transactions_raw = transactions_raw[:page_size]
         
-        # Process transactions
-        transactions = []
-        for trans in transactions_raw:
-            processed_trans = {
-                "id": str(trans["id"]) if trans["id"] is not None else "",
-                "request_id": str(trans["request_id"]) if trans["request_id"] is not None else "",
-                "idno": str(trans["idno"]) if trans["idno"] is not None else "",
-                "name": str(trans["name"]) if trans["name"] is not None else "",
-                "level": str(trans["level"]) if trans["level"] is not None else "",
-                "method": str(trans["method"]) if trans["method"] is not None else "",
-                "payment": str(trans["payment"]) if trans["payment"] is not None else "",
-                "status": str(trans["status"]) if trans["status"] is not None else "",
-                "processed_by": str(trans["processed_by"]) if trans["processed_by"] is not None else "",
-                "admin_name": str(trans["admin_name"]) if trans["admin_name"] is not None else "",
-                "notes": str(trans["notes"]) if trans["notes"] is not None else "",
-                "action_date": None
-            }
-            
-            # Handle datetime conversion safely
-            action_date = trans["action_date"]
-            if action_date:
-                if isinstance(action_date, datetime):
-                    processed_trans["action_date"] = action_date.isoformat()
-                else:
-                    processed_trans["action_date"] = str(action_date)
-            
-            transactions.append(processed_trans)
-        
-        return jsonify(transactions)
+        response = json_response(HISTORY_ROW.many(transactions_raw))
+        last = transactions_raw[-1] if transactions_raw else None
+        if has_more and last and isinstance(last["action_date"], datetime):
+            response.headers['X-Next-Cursor'] = encode_history_cursor(last, filters)
+        return response
     except Exception as e:
         print(f"Error getting transaction history: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -3108,6 +3459,94 @@ def get_transaction_history():
         if conn and conn.is_connected():
             conn.close()
 
+# Columns written by the history export, in file order
+HISTORY_EXPORT_COLUMNS = ['id', 'request_id', 'idno', 'name', 'level', 'method', 'payment',
+                          'status', 'processed_by', 'admin_name', 'notes', 'action_date']
+HISTORY_EXPORT_BATCH = 500
+
+def _history_export_values(row):
+    """Row values formatted the same way as the history listing"""
+    values = []
+    for value in row:
+        if value is None:
+            values.append("")
+        elif isinstance(value, datetime):
+            values.append(value.isoformat())
+        else:
+            values.append(str(value))
+    return values
+
+@app.route('/api/transaction_history/export', methods=['GET'])
+@token_required
+def export_transaction_history():
+    """Stream the filtered transaction history as CSV or NDJSON in constant memory"""
+    if not g.user.get('is_admin'):
+        return jsonify({"error": "Admin privileges required"}), 403
+    
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be 'csv' or 'ndjson'"}), 400
+    
+    try:
+        conditions, params = build_history_filter(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Database connection failed"}), 500
+    
+    query = (f"SELECT {', '.join(HISTORY_EXPORT_COLUMNS)} FROM transaction_history WHERE 1=1{conditions}"
+             " ORDER BY action_date DESC, id DESC")
+    
+    def generate():
+        # Unbuffered cursor: MySQL streams the result and we pull it off the socket a
+        # batch at a time, so only one batch is ever held in memory
+        cursor = conn.cursor(buffered=False)
+        finished = False
+        try:
+            cursor.execute(query, tuple(params))
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if export_format == 'csv':
+                writer.writerow(HISTORY_EXPORT_COLUMNS)
+                yield buffer.getvalue()
+            while True:
+                rows = cursor.fetchmany(HISTORY_EXPORT_BATCH)
+                if not rows:
+                    break
+                buffer.seek(0)
+                buffer.truncate()
+                for row in rows:
+                    values = _history_export_values(row)
+                    if export_format == 'csv':
+                        writer.writerow(values)
+                    else:
+                        buffer.write(json.dumps(dict(zip(HISTORY_EXPORT_COLUMNS, values))))
+                        buffer.write('\n')
+                yield buffer.getvalue()
+            finished = True
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+            if finished:
+                conn.close()
+            else:
+                # Client went away mid-stream; the unread result makes the connection unusable
+                conn.discard()
+    
+    if export_format == 'csv':
+        mimetype, filename = 'text/csv', 'transaction_history.csv'
+    else:
+        mimetype, filename = 'application/x-ndjson', 'transaction_history.ndjson'
+    
+    # stream_with_context keeps the request (and its borrowed connection) alive until the generator ends
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
 @app.route('/api/transaction_history_stats', methods=['GET'])
 @token_required
 def get_transaction_history_stats():
@@ -3115,9 +3554,12 @@ def get_transaction_history_stats():
     if not g.user.get('is_admin'):
         return jsonify({"error": "Admin privileges required"}), 403
     
-    # Get filter parameters
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
+    # Same filters as the history listing
+    try:
+        rollup_filter = build_rollup_filter(request.args)
+        history_filter = build_history_filter(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     conn, cursor = None, None
     try:
@@ -3127,57 +3569,46 @@ def get_transaction_history_stats():
         
         cursor = conn.cursor(dictionary=True)
         
-        # Build date filter
-        date_filter = ""
-        params = []
-        
-        if start_date:
-            date_filter += " AND DATE(action_date) >= %s"
-            params.append(start_date)
-        
-        if end_date:
-            date_filter += " AND DATE(action_date) <= %s"
-            params.append(end_date)
-        
-        # Get count by status
-        cursor.execute(f"""
-            SELECT status, COUNT(*) as count
-            FROM transaction_history
-            WHERE 1=1 {date_filter}
-            GROUP BY status
-        """, tuple(params))
-        
+        if rollup_filter is not None:
+            # One small query over the per-day counts, however large the history is
+            conditions, params = rollup_filter
+            cursor.execute(f"""
+                SELECT status, payment, processed_by, admin_name, SUM(total) as count
+                FROM transaction_history_daily
+                WHERE 1=1 {conditions}
+                GROUP BY status, payment, processed_by, admin_name
+            """, tuple(params))
+        else:
+            # idno and non-default time zone filters need the raw rows
+            conditions, params = history_filter
+            cursor.execute(f"""
+                SELECT COALESCE(status, '') as status, COALESCE(payment, '') as payment,
+                       COALESCE(processed_by, 0) as processed_by, COALESCE(admin_name, '') as admin_name,
+                       COUNT(*) as count
+                FROM transaction_history
+                WHERE 1=1 {conditions}
+                GROUP BY 1, 2, 3, 4
+            """, tuple(params))
+        
+        # Fold the grouped rows into counts by status, by payment type and by admin
         status_counts = {}
-        for row in cursor.fetchall():
-            status_counts[row["status"]] = row["count"]
-        
-        # Get count by payment type
-        cursor.execute(f"""
-            SELECT payment, COUNT(*) as count
-            FROM transaction_history
-            WHERE 1=1 {date_filter}
-            GROUP BY payment
-        """, tuple(params))
-        
         payment_counts = {}
+        admin_totals = {}
         for row in cursor.fetchall():
+            count = int(row["count"])
+            status = row["status"] if row["status"] else "unknown"
+            status_counts[status] = status_counts.get(status, 0) + count
             payment = row["payment"] if row["payment"] else "unknown"
-            payment_counts[payment] = row["count"]
-        
-        # Get count by admin
-        cursor.execute(f"""
-            SELECT processed_by, admin_name, COUNT(*) as count
-            FROM transaction_history
-            WHERE 1=1 {date_filter}
-            GROUP BY processed_by, admin_name
-        """, tuple(params))
+            payment_counts[payment] = payment_counts.get(payment, 0) + count
+            admin_key = (row["processed_by"], row["admin_name"])
+            admin_totals[admin_key] = admin_totals.get(admin_key, 0) + count
         
         admin_counts = []
-        for row in cursor.fetchall():
+        for (processed_by, admin_name), count in admin_totals.items():
             admin_counts.append({
-                "id": str(row["processed_by"]) if row["processed_by"] is not None else "",
-                "name": str(row["admin_name"]) if row["admin_name"] is not None else "Unknown",
-                "count": row["count"]
+                "id": str(processed_by) if processed_by else "",
+                "name": str(admin_name) if admin_name else "Unknown",
+                "count": count
             })
         
         return jsonify({
@@ -3248,66 +3679,33 @@ def create_ticker_messages_table():
     if not g.user.get('is_admin'):
         return jsonify({"error": "Admin privileges required"}), 403
     
-    conn, cursor = None, None
+    conn = None
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({"error": "Database connection failed"}), 500
         
-        cursor = conn.cursor()
-        
-        # Create ticker_messages table if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS ticker_messages (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                message TEXT NOT NULL,
-                display_order INT DEFAULT 0,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-            )
-        """)
-        
-        conn.commit()
+        # The table is owned by the schema migrations; make sure they have been applied
+        run_migrations(conn)
         
         return jsonify({"success": True, "message": "Ticker messages table created successfully"})
     except Exception as e:
         print(f"Error creating ticker messages table: {str(e)}")
         return jsonify({"error": str(e)}), 500
     finally:
-        if cursor:
-            cursor.close()
         if conn and conn.is_connected():
             conn.close()
 
-@app.route('/api/ticker_messages', methods=['GET'])
-def get_ticker_messages():
-    """Get all active ticker messages"""
+def load_ticker_messages():
+    """Active ticker messages, seeding the defaults when there are none"""
     conn, cursor = None, None
     try:
         conn = get_db_connection()
         if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
+            raise RuntimeError("Database connection failed")
         
         cursor = conn.cursor(dictionary=True)
         
-        # Try to create the table if it doesn't exist
-        try:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ticker_messages (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    message TEXT NOT NULL,
-                    display_order INT DEFAULT 0,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
-        except Exception as e:
-            print(f"Error creating ticker messages table: {str(e)}")
-            # Continue with the operation even if table creation fails
-        
         # Get all active ticker messages, ordered by display_order
         cursor.execute("""
             SELECT id, message, display_order, is_active
@@ -3341,28 +3739,214 @@ def get_ticker_messages():
                 print(f"Error inserting default ticker messages: {str(e)}")
             
             # Return default messages
-            return jsonify({
+            return {
                 "messages": default_messages
-            })
+            }
         
         # Process the messages
         messages = []
         for msg in messages_raw:
             messages.append(str(msg["message"]) if msg["message"] is not None else "")
         
-        return jsonify({
+        return {
             "messages": messages
-        })
+        }
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+@app.route('/api/ticker_messages', methods=['GET'])
+def get_ticker_messages():
+    """Get all active ticker messages"""
+    return cached_json_response('ticker_messages', load_ticker_messages)
+
+# (event name, tv_cache key, loader) for each channel of the TV stream
+TV_STREAM_CHANNELS = [
+    ("queue", "tv_pending_requests", load_tv_pending_requests),
+    ("admins", "active_admins", load_active_admins),
+    ("ticker", "ticker_messages", load_ticker_messages),
+]
+
+def parse_stream_event_id(value):
+    """Last-Event-ID ("queue:<hash>,admins:<hash>,...") -> {channel: hash}"""
+    hashes = {}
+    for part in (value or '').split(','):
+        channel, _, digest = part.partition(':')
+        if channel and digest:
+            hashes[channel] = digest
+    return hashes
+
+def tv_stream_events(sent):
+    """SSE messages for every channel whose content differs from `sent`, until the time cap"""
+    started = last_write = time.monotonic()
+    yield "retry: 3000\n\n"
+    while time.monotonic() - started < TV_STREAM_MAX_SECONDS:
+        seen = tv_cache.invalidations
+        messages = []
+        for channel, key, loader in TV_STREAM_CHANNELS:
+            try:
+                body, etag = tv_cache.get(key, lambda loader=loader: encode_with_etag(loader()))
+            except Exception as e:
+                print(f"Error loading {key} for TV stream: {str(e)}")
+                continue
+            digest = etag[:12]
+            if sent.get(channel) == digest:
+                continue
+            sent[channel] = digest
+            # The id covers everything delivered so far, so a resume skips exactly that
+            event_id = ",".join(f"{name}:{sent[name]}" for name, _, _ in TV_STREAM_CHANNELS if name in sent)
+            messages.append(f"id: {event_id}\nevent: {channel}\ndata: {body.decode('utf-8')}\n\n")
+        
+        now = time.monotonic()
+        if messages:
+            yield "".join(messages)
+            last_write = now
+        elif now - last_write >= TV_STREAM_HEARTBEAT:
+            yield ": heartbeat\n\n"
+            last_write = now
+        
+        # Writes in this worker wake the stream at once; other workers' writes
+        # are picked up on the next interval once the cache entry expires
+        tv_cache.wait_for_invalidation(seen, TV_STREAM_INTERVAL)
+
+def load_tv_windows():
+    """Active admins with their room names and filter settings, in one query"""
+    conn, cursor = None, None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database connection failed")
         
-    except Exception as e:
-        print(f"Error getting ticker messages: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT a.id, a.full_name, a.room_name, s.settings, s.updated_at
+            FROM admins a
+            LEFT JOIN admin_settings s ON s.admin_id = a.id
+            WHERE a.is_active = 'yes'
+            ORDER BY a.id
+        """)
+        
+        windows = []
+        for row in cursor.fetchall():
+            filter_settings = dict(DEFAULT_FILTER_SETTINGS)
+            if row["settings"]:
+                try:
+                    settings = parse_admin_settings(row["id"], row["updated_at"], row["settings"])
+                    filter_settings = settings.get('filter_settings') or filter_settings
+                except (ValueError, AttributeError):
+                    print(f"Ignoring unreadable settings for admin {row['id']}")
+            windows.append({
+                "id": row["id"],
+                "name": row["full_name"],
+                "room_name": row["room_name"],
+                "filter_settings": filter_settings
+            })
+        return windows
     finally:
         if cursor:
             cursor.close()
         if conn and conn.is_connected():
             conn.close()
 
+# Queue rows as shown inside a TV window
+TV_WINDOW_ROW = RowSchema([
+    ("id", "str"), ("request_id", "str"), ("name", "str"), ("level", "str"), ("payment", "str"),
+    ("status", "str"), ("schedule", "datetime"), ("assigned_to", "int")
+])
+
+# Rows each TV window shows, unless ?limit= asks for more (up to TV_WINDOW_MAX_ROWS)
+TV_WINDOW_ROWS = int(os.environ.get('TV_WINDOW_ROWS', 3))
+TV_WINDOW_MAX_ROWS = 20
+
+def project_tv_windows(windows, rows, limit, assigned_only=False, now=None):
+    """Each window with the first `limit` queue rows it shows and how many it matches in total
+
+    A window shows rows assigned to its admin or (unless assigned_only) to nobody,
+    in a lane its filter settings enable (rows without a payment type always),
+    that aren't scheduled for later than now.
+    """
+    now = now or datetime.now()
+    projected = []
+    for window in windows:
+        admin_id = window["id"]
+        filter_settings = window["filter_settings"]
+        shown = []
+        total = 0
+        for row in rows:
+            if row['assigned_to'] != admin_id and (assigned_only or row['assigned_to'] is not None):
+                continue
+            if row['schedule'] is not None and row['schedule'] > now:
+                continue
+            if row['payment'] and not filter_settings.get(row['payment']):
+                continue
+            total += 1
+            if len(shown) < limit:
+                shown.append(row)
+        projected.append(dict(window, requests=TV_WINDOW_ROW.many(shown), total=total))
+    return projected
+
+def tv_window_projection(limit, assigned_only=False):
+    """Encoded /api/tv/windows body and ETag, shared by every screen until the queue or admins change"""
+    admins_body, admins_etag = tv_cache.get('active_admins:windows', lambda: encode_with_etag(load_tv_windows()))
+    queue_engine.ensure_loaded()
+    # Scheduled requests come into view as time passes, hence the minute
+    minute = datetime.now().strftime('%Y%m%d%H%M')
+    key = f"tv_windows:{admins_etag}:{queue_engine.version}:{minute}:{limit}:{int(assigned_only)}"
+    return tv_cache.get(key, lambda: encode_with_etag(
+        project_tv_windows(json.loads(admins_body), queue_engine.active(), limit, assigned_only)))
+
+@app.route('/api/tv/windows', methods=['GET'])
+def get_tv_windows():
+    """Active admins' TV windows, each with only the queue rows it displays"""
+    try:
+        limit = min(max(int(request.args.get('limit', TV_WINDOW_ROWS)), 1), TV_WINDOW_MAX_ROWS)
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    assigned_only = request.args.get('assigned_only', '').lower() in ('1', 'true', 'yes')
+    try:
+        body, etag = tv_window_projection(limit, assigned_only)
+    except Exception as e:
+        print(f"Error building TV windows: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    return conditional_json_response(body, etag)
+
+@app.route('/api/tv/snapshot', methods=['GET'])
+def get_tv_snapshot():
+    """Everything a TV display shows, in one response: admins and their filters, queue, windows, ticker"""
+    try:
+        # Each part is cached (and invalidated) on its own; the response is
+        # stitched together from the already encoded bodies
+        admins_body, _ = tv_cache.get('active_admins:windows', lambda: encode_with_etag(load_tv_windows()))
+        queue_body, _ = tv_cache.get('tv_pending_requests', lambda: encode_with_etag(load_tv_pending_requests()))
+        ticker_body, _ = tv_cache.get('ticker_messages', lambda: encode_with_etag(load_ticker_messages()))
+        windows_body, _ = tv_window_projection(TV_WINDOW_ROWS)
+    except Exception as e:
+        print(f"Error building TV snapshot: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    
+    body = b''.join([
+        b'{"active_admins":', admins_body,
+        b',"announcements_version":', dumps(file_etag(ANNOUNCEMENTS_FILE)),
+        b',"queue_version":', dumps(queue_log.current_version()),
+        b',"requests":', queue_body,
+        b',"ticker":', ticker_body,
+        b',"windows":', windows_body,
+        b'}'
+    ])
+    return conditional_json_response(body)
+
+@app.route('/api/tv/stream', methods=['GET'])
+def tv_stream():
+    """Server-Sent Events for the TV displays: queue, admins and ticker, pushed when they change"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    response = Response(tv_stream_events(parse_stream_event_id(last_event_id)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/ticker_messages/all', methods=['GET'])
 @token_required
 def get_all_ticker_messages():
@@ -3447,6 +4031,7 @@ def save_ticker_messages():
                 """, (message, i))
         
         conn.commit()
+        tv_cache.invalidate('ticker_messages')
         
         return jsonify({
             "success": True,
@@ -3504,6 +4089,7 @@ def update_ticker_message(message_id):
             return jsonify({"error": "Message not found"}), 404
             
         conn.commit()
+        tv_cache.invalidate('ticker_messages')
         
         return jsonify({
             "success": True,
@@ -3542,6 +4128,7 @@ def delete_ticker_message(message_id):
             return jsonify({"error": "Message not found"}), 404
             
         conn.commit()
+        tv_cache.invalidate('ticker_messages')
         
         return jsonify({
             "success": True,
@@ -3558,6 +4145,38 @@ def delete_ticker_message(message_id):
         if conn and conn.is_connected():
             conn.close()
 
+@app.route('/api/admin/db-pool-stats', methods=['GET'])
+@token_required
+def get_db_pool_stats():
+    """Connection pool usage counters (admin only)"""
+    if not g.user.get('is_admin'):
+        return jsonify({"error": "Admin privileges required"}), 403
+    return jsonify(db_pool.stats())
+
+@app.route('/api/admin/cache-stats', methods=['GET'])
+@token_required
+def get_cache_stats():
+    """TV response cache counters (admin only)"""
+    if not g.user.get('is_admin'):
+        return jsonify({"error": "Admin privileges required"}), 403
+    return jsonify(tv_cache.stats())
+
+@app.route('/api/admin/queue-stats', methods=['GET'])
+@token_required
+def get_queue_stats():
+    """In-memory queue engine counters and drift, and the service times behind wait estimates (admin only)"""
+    if not g.user.get('is_admin'):
+        return jsonify({"error": "Admin privileges required"}), 403
+    return jsonify(dict(queue_engine.stats(), service_times=service_times.stats()))
+
+@app.route('/api/admin/jobs', methods=['GET'])
+@token_required
+def get_job_stats():
+    """Background job run times and leader lease state (admin only)"""
+    if not g.user.get('is_admin'):
+        return jsonify({"error": "Admin privileges required"}), 403
+    return jsonify(job_scheduler.stats())
+
 # Serve public TV display page
 @app.route('/public_tv')
 def public_tv_display_page():
@@ -3634,7 +4253,7 @@ if __name__ == '__main__':
     except:
         pass
     
-    # Start the auto-reject background thread
-    auto_reject_thread.start()
+    # Start the background jobs (auto-reject, queue reconcile)
+    job_scheduler.start()
     
     app.run(host='0.0.0.0', port=5057, debug=True)
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""How long serving one request takes, by payment lane and hour of day.
+
+Service times are read from transaction_history: the time between two
+consecutive entries logged by the same admin is the time that admin spent on
+the later request. Gaps longer than `max_gap`, or spanning two days, are
+breaks rather than service and are ignored.
+
+    stats = ServiceTimeStats()
+    stats.refresh(cursor)                         # periodically; only reads new rows
+    stats.service_time('express', 14)             # seconds, for 14:00-14:59
+    stats.estimate_wait({'express': 3, 'regular': 1}, windows=2)
+
+Each (lane, hour) keeps a running mean that weights recent samples by
+`smoothing`, so it follows changes in how fast the office works without
+keeping the samples themselves. A bucket with fewer than `min_samples` falls
+back to the lane's all-day mean, then to the mean over all lanes, then to
+`default_seconds`.
+"""
+import threading
+from datetime import datetime, timedelta
+
+
+class ServiceTimeStats:
+    """Running per-lane, per-hour service time means, fed incrementally from transaction_history"""
+
+    def __init__(self, default_seconds=300, max_gap=timedelta(minutes=30), smoothing=0.05,
+                 min_samples=5, history_days=28, batch_size=5000):
+        self.default_seconds = default_seconds
+        self.max_gap = max_gap
+        self.smoothing = smoothing
+        self.min_samples = min_samples
+        self.history_days = history_days
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        # (lane, hour) -> [mean seconds, samples]; hour None is the lane's all-day
+        # mean and lane None the mean over every lane
+        self._means = {}
+        # processed_by -> action_date of that admin's last entry
+        self._last_action = {}
+        self.last_id = None
+        self.rows_read = 0
+        self.last_refresh = None
+
+    # --- loading -------------------------------------------------------------
+
+    def refresh(self, cursor):
+        """Read history entries logged since the last refresh; return how many"""
+        if self.last_id is None:
+            # First load: the last history_days of history, oldest first. Later
+            # refreshes go on from the newest entry in the table, even when
+            # none of it falls inside that window
+            cursor.execute("SELECT COALESCE(MAX(id), 0) AS id FROM transaction_history")
+            last_id = cursor.fetchone()['id']
+            since = datetime.now() - timedelta(days=self.history_days)
+            cursor.execute("""
+                SELECT id, payment, processed_by, action_date FROM transaction_history
+                WHERE action_date >= %s AND id <= %s ORDER BY action_date, id
+            """, (since, last_id))
+            rows = cursor.fetchall()
+        else:
+            rows = []
+            last_id = self.last_id
+            while True:
+                cursor.execute("""
+                    SELECT id, payment, processed_by, action_date FROM transaction_history
+                    WHERE id > %s ORDER BY id LIMIT %s
+                """, (last_id, self.batch_size))
+                batch = cursor.fetchall()
+                rows.extend(batch)
+                if batch:
+                    last_id = batch[-1]['id']
+                if len(batch) < self.batch_size:
+                    break
+
+        with self._lock:
+            for row in rows:
+                self._feed(row)
+            self.last_id = last_id
+            self.rows_read += len(rows)
+            self.last_refresh = datetime.now()
+        return len(rows)
+
+    def _feed(self, row):
+        admin_id, action_date = row['processed_by'], row['action_date']
+        if admin_id is None or action_date is None:
+            return
+        previous = self._last_action.get(admin_id)
+        if previous is not None and action_date < previous:
+            return
+        self._last_action[admin_id] = action_date
+        if previous is None or previous.date() != action_date.date():
+            return
+        gap = action_date - previous
+        if timedelta(0) < gap <= self.max_gap:
+            self._add(row['payment'] or '', action_date.hour, gap.total_seconds())
+
+    def _add(self, lane, hour, seconds):
+        for key in ((lane, hour), (lane, None), (None, None)):
+            bucket = self._means.setdefault(key, [0.0, 0])
+            bucket[1] += 1
+            # Plain average until there are enough samples for the smoothing to take over
+            weight = max(self.smoothing, 1.0 / bucket[1])
+            bucket[0] += weight * (seconds - bucket[0])
+
+    # --- estimates -----------------------------------------------------------
+
+    def service_time(self, lane, hour):
+        """Expected seconds to serve one request from `lane` during `hour`"""
+        with self._lock:
+            return self._service_time(lane or '', hour)
+
+    def _service_time(self, lane, hour):
+        for key in ((lane, hour), (lane, None), (None, None)):
+            bucket = self._means.get(key)
+            if bucket is not None and bucket[1] >= self.min_samples:
+                return bucket[0]
+        return self.default_seconds
+
+    def estimate_wait(self, ahead, windows=1, moment=None):
+        """Seconds until the requests in `ahead` ({lane: count}) have been served by `windows` admins"""
+        hour = (moment or datetime.now()).hour
+        with self._lock:
+            total = sum(count * self._service_time(lane or '', hour) for lane, count in ahead.items())
+        return total / max(1, windows)
+
+    def stats(self):
+        with self._lock:
+            lanes = {}
+            for (lane, hour), (mean, samples) in self._means.items():
+                if lane is None:
+                    continue
+                entry = lanes.setdefault(lane or 'none', {"mean_seconds": None, "samples": 0, "by_hour": {}})
+                if hour is None:
+                    entry["mean_seconds"] = round(mean, 1)
+                    entry["samples"] = samples
+                else:
+                    entry["by_hour"][hour] = {"mean_seconds": round(mean, 1), "samples": samples}
+            overall = self._means.get((None, None))
+            return {
+                "overall_seconds": round(overall[0], 1) if overall else None,
+                "samples": overall[1] if overall else 0,
+                "lanes": lanes,
+                "default_seconds": self.default_seconds,
+                "last_id": self.last_id,
+                "rows_read": self.rows_read,
+                "last_refresh": self.last_refresh.isoformat() if self.last_refresh else None
+            }
@@ -0,0 +1,218 @@
+"""Appointment slot capacity and the booked counts that enforce it.
+
+A slot is a SLOT_MINUTES-long window of one day. How many requests a slot
+takes is configured per weekday (0 = Monday) and slot start in slot_capacity
+(a weekly template); slots without a row take `default_capacity` (None: no limit), and
+days marked full or unavailable on the calendar take none.
+
+slot_counts holds how many open (pending or on-call) requests are booked
+into each slot; a request gives its place back when it is completed, rejected
+or cleared. Booking
+reserves a place with a conditional increment inside the booking transaction,
+so two bookings racing for the last place can't both get it:
+
+    if not reserve_slot(cursor, schedule):
+        conn.rollback()     # 409, slot is full
+
+Cancelling or moving a request gives its place back with release_slot(). To
+rebuild the counts from the requests table (after a manual import, say):
+
+    python slots.py                     # rebuild everything
+    python slots.py --since 2025-01-01  # rebuild from a day onwards
+"""
+import os
+import sys
+from datetime import datetime, time, timedelta
+
+from database import db_pool
+
+SLOT_MINUTES = int(os.environ.get('SLOT_MINUTES', 30))
+
+CREATE_SLOT_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS slot_capacity (
+        weekday TINYINT NOT NULL,
+        slot_time TIME NOT NULL,
+        capacity INT NOT NULL,
+        PRIMARY KEY (weekday, slot_time)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS slot_counts (
+        slot_date DATE NOT NULL,
+        slot_time TIME NOT NULL,
+        booked INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (slot_date, slot_time)
+    )
+    """,
+]
+
+# Calendar statuses that close a whole day
+CLOSED_DAY_STATUSES = ('full', 'unavail')
+
+# Formats clients send appointment times in
+SCHEDULE_FORMATS = ('%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %I:%M %p')
+
+
+def parse_schedule(value):
+    """'2025-06-02 09:30' (or with seconds, or 12-hour) -> datetime; ValueError otherwise"""
+    for fmt in SCHEDULE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid date or time: {value}")
+
+
+def slot_of(moment, minutes=SLOT_MINUTES):
+    """(date, slot start) of the slot `moment` falls in"""
+    start = (moment.hour * 60 + moment.minute) // minutes * minutes
+    return moment.date(), time(start // 60, start % 60)
+
+
+def slot_capacity(cursor, day, slot_time, default_capacity=None):
+    """Places in a slot: 0 on closed days, else the template value or default_capacity"""
+    cursor.execute("SELECT status FROM schedule WHERE date = %s", (day,))
+    row = cursor.fetchone()
+    if row is not None and _first(row) in CLOSED_DAY_STATUSES:
+        return 0
+    cursor.execute("SELECT capacity FROM slot_capacity WHERE weekday = %s AND slot_time = %s",
+                   (day.weekday(), slot_time))
+    row = cursor.fetchone()
+    return default_capacity if row is None else _first(row)
+
+
+def reserve_slot(cursor, moment, minutes=SLOT_MINUTES, default_capacity=None, enforce=True):
+    """Take a place in the slot of `moment`; False when it is full (nothing is changed then)
+
+    Run inside the booking transaction: the slot's count row stays locked until
+    it commits or rolls back. With enforce=False (admin rescheduling) the
+    place is taken even past capacity.
+    """
+    day, slot_time = slot_of(moment, minutes)
+    capacity = slot_capacity(cursor, day, slot_time, default_capacity) if enforce else None
+    if capacity is not None and capacity <= 0:
+        return False
+    cursor.execute("INSERT IGNORE INTO slot_counts (slot_date, slot_time, booked) VALUES (%s, %s, 0)",
+                   (day, slot_time))
+    if capacity is None:
+        cursor.execute("UPDATE slot_counts SET booked = booked + 1 WHERE slot_date = %s AND slot_time = %s",
+                       (day, slot_time))
+    else:
+        cursor.execute("""
+            UPDATE slot_counts SET booked = booked + 1
+            WHERE slot_date = %s AND slot_time = %s AND booked < %s
+        """, (day, slot_time, capacity))
+    return cursor.rowcount == 1
+
+
+def release_slot(cursor, moment, minutes=SLOT_MINUTES):
+    """Give back a place in the slot of `moment` (no-op for None)"""
+    if moment is None:
+        return
+    day, slot_time = slot_of(moment, minutes)
+    cursor.execute("""
+        UPDATE slot_counts SET booked = booked - 1
+        WHERE slot_date = %s AND slot_time = %s AND booked > 0
+    """, (day, slot_time))
+
+
+def availability(cursor, start, end, minutes=SLOT_MINUTES, default_capacity=None):
+    """{date: {"status", "slots": [{time, capacity, booked, remaining}]}} for start..end inclusive
+
+    Lists the configured slots of each day plus any other slot with bookings.
+    capacity and remaining are None for slots without a limit.
+    """
+    cursor.execute("SELECT weekday, slot_time, capacity FROM slot_capacity")
+    template = {}
+    for weekday, slot_time, capacity in _tuples(cursor.fetchall(), ('weekday', 'slot_time', 'capacity')):
+        template.setdefault(weekday, {})[as_time(slot_time)] = capacity
+
+    cursor.execute("SELECT slot_date, slot_time, booked FROM slot_counts WHERE slot_date BETWEEN %s AND %s",
+                   (start, end))
+    booked = {}
+    for slot_date, slot_time, count in _tuples(cursor.fetchall(), ('slot_date', 'slot_time', 'booked')):
+        booked.setdefault(slot_date, {})[as_time(slot_time)] = count
+
+    cursor.execute("SELECT date, status FROM schedule WHERE date BETWEEN %s AND %s", (start, end))
+    statuses = {day: status for day, status in _tuples(cursor.fetchall(), ('date', 'status'))}
+
+    days = {}
+    day = start
+    while day <= end:
+        status = statuses.get(day)
+        configured = template.get(day.weekday(), {})
+        counts = booked.get(day, {})
+        slots = []
+        for slot_time in sorted(set(configured) | set(counts)):
+            if status in CLOSED_DAY_STATUSES:
+                capacity = 0
+            else:
+                capacity = configured.get(slot_time, default_capacity)
+            count = counts.get(slot_time, 0)
+            slots.append({
+                "time": slot_time.strftime('%H:%M'),
+                "capacity": capacity,
+                "booked": count,
+                "remaining": None if capacity is None else max(0, capacity - count)
+            })
+        days[day.isoformat()] = {"status": status or "open", "slots": slots}
+        day += timedelta(days=1)
+    return days
+
+
+def rebuild_counts(cursor, since=None, minutes=SLOT_MINUTES):
+    """Recompute slot_counts from the requests table, optionally only from `since` (a date) on"""
+    slot_start = f"SEC_TO_TIME(FLOOR(TIME_TO_SEC(TIME(schedule)) / {minutes * 60}) * {minutes * 60})"
+    if since is None:
+        cursor.execute("DELETE FROM slot_counts")
+        cursor.execute(f"""
+            INSERT INTO slot_counts (slot_date, slot_time, booked)
+            SELECT DATE(schedule), {slot_start}, COUNT(*)
+            FROM requests
+            WHERE schedule IS NOT NULL AND status IN ('pending', 'oncall')
+            GROUP BY 1, 2
+        """)
+    else:
+        cursor.execute("DELETE FROM slot_counts WHERE slot_date >= %s", (since,))
+        cursor.execute(f"""
+            INSERT INTO slot_counts (slot_date, slot_time, booked)
+            SELECT DATE(schedule), {slot_start}, COUNT(*)
+            FROM requests
+            WHERE schedule >= %s AND status IN ('pending', 'oncall')
+            GROUP BY 1, 2
+        """, (since,))
+
+
+def _first(row):
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def _tuples(rows, columns):
+    return [tuple(row[column] for column in columns) if isinstance(row, dict) else row for row in rows]
+
+
+def as_time(value):
+    """A TIME column value as a datetime.time (MySQL hands them back as timedelta)"""
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        return time(seconds // 3600, seconds % 3600 // 60)
+    return value
+
+
+if __name__ == '__main__':
+    since = None
+    if '--since' in sys.argv[1:]:
+        since = datetime.strptime(sys.argv[sys.argv.index('--since') + 1], '%Y-%m-%d').date()
+
+    conn = db_pool.acquire()
+    cursor = conn.cursor()
+    try:
+        rebuild_counts(cursor, since)
+        conn.commit()
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(booked), 0) FROM slot_counts")
+        slots, bookings = cursor.fetchone()
+        print(f"Slot counts rebuilt: {slots} slots holding {bookings} bookings")
+    finally:
+        cursor.close()
+        conn.close()
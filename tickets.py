@@ -0,0 +1,78 @@
+"""Sequential ticket numbers (E-0001, R-0002, ...) per day and payment lane.
+
+Numbers come from one row per (day, lane) in ticket_sequences. A worker never
+takes them one at a time: it reserves a block of `block_size` numbers with a
+single statement and hands them out from memory until the block runs out.
+
+    tickets = TicketAllocator(db_pool, block_size=10)
+    tickets.allocate('express', '2025-06-02')   # -> 'E-0001'
+
+The reservation bumps the counter and reads the new value in the same
+statement (INSERT ... ON DUPLICATE KEY UPDATE next_value =
+LAST_INSERT_ID(next_value + n)), on its own connection committed at once, so
+the counter row is locked only for that statement and two workers can never
+reserve the same block. Blocks handed to different workers interleave, so
+tickets are unique but not strictly in booking order, and numbers left in a
+block when a worker exits are skipped.
+"""
+import threading
+
+CREATE_TICKET_SEQUENCES = """
+    CREATE TABLE IF NOT EXISTS ticket_sequences (
+        day DATE NOT NULL,
+        lane VARCHAR(20) NOT NULL,
+        next_value INT NOT NULL,
+        PRIMARY KEY (day, lane)
+    )
+"""
+
+# next_value is the first number not yet reserved; LAST_INSERT_ID() returns it
+# after the reservation either way
+RESERVE_BLOCK = """
+    INSERT INTO ticket_sequences (day, lane, next_value) VALUES (%s, %s, LAST_INSERT_ID(%s))
+    ON DUPLICATE KEY UPDATE next_value = LAST_INSERT_ID(next_value + %s)
+"""
+
+
+def format_ticket(lane, number):
+    """'express', 7 -> 'E-0007'"""
+    return f"{(lane or 'T')[0].upper()}-{number:04d}"
+
+
+class TicketAllocator:
+    """Hands out ticket numbers from blocks reserved in ticket_sequences"""
+
+    def __init__(self, pool, block_size=10):
+        self.pool = pool
+        self.block_size = max(1, block_size)
+        self._lock = threading.Lock()
+        # (day, lane) -> [next number, end of block (exclusive)]
+        self._blocks = {}
+        self.reservations = 0
+
+    def _reserve(self, day, lane):
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(RESERVE_BLOCK, (day, lane, self.block_size + 1, self.block_size))
+            cursor.execute("SELECT LAST_INSERT_ID()")
+            end = cursor.fetchone()[0]
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        return [end - self.block_size, end]
+
+    def allocate(self, lane, day):
+        """Next ticket for `lane` on `day` (a date or 'YYYY-MM-DD')"""
+        key = (str(day), lane or '')
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None or block[0] >= block[1]:
+                # Reserving under the lock keeps a worker from reserving two blocks at once
+                block = self._blocks[key] = self._reserve(*key)
+                self.reservations += 1
+            number = block[0]
+            block[0] += 1
+        return format_ticket(lane, number)
+